@@ -1,180 +1,643 @@
-import re
-import requests
-import time
-import random
-import csv
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse, urlunparse
-from datetime import datetime
-from pathlib import Path
-
-# Get absolute path to the directory containing this script
-SCRIPT_DIR = Path(__file__).parent.resolve()
-
-# Get timestamp at script start
-start_time = datetime.now()
-timestamp_str = start_time.strftime("%Y%m%d%H%M%S")
-output_filename = f"{timestamp_str}_obtained_urls_puma.csv"
-
-# Create downloaded_htmls/<timestamp_str> directory for saving HTMLs
-downloaded_htmls_dir = SCRIPT_DIR / 'downloaded_htmls'
-session_html_dir = downloaded_htmls_dir / timestamp_str
-session_html_dir.mkdir(parents=True, exist_ok=True)
-output_filepath = session_html_dir / output_filename
-
-# Create a temp file named temp.txt
-temp_file_path = SCRIPT_DIR / 'temp.txt'
-with open(temp_file_path, 'w', encoding='utf-8') as temp_file:
-    temp_file.write('Temporary file for process status.\n')
-    temp_file.write(f'output_dir={session_html_dir.relative_to(SCRIPT_DIR)}\n')
-    print(f"\n[SESSION]Session HTML directory: {session_html_dir}")
-
-def save_html_content(url, html, session_html_dir=session_html_dir):
-    # Create a safe filename from the URL
-    parsed = urlparse(url)
-    safe_path = parsed.path.strip('/').replace('/', '_')
-    if not safe_path:
-        safe_path = 'index'
-    filename = f"{parsed.netloc}_{safe_path}.html"
-    filepath = session_html_dir / filename
-    with open(filepath, 'w', encoding='utf-8') as f:
-        f.write(html)
-
-USER_AGENTS = [
-    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
-    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.1 Safari/605.1.15',
-    'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:89.0) Gecko/20100101 Firefox/89.0',
-    'Mozilla/5.0 (iPhone; CPU iPhone OS 14_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0 Mobile/15E148 Safari/604.1'
-]
-
-def get_html(url):
-    headers = {'User-Agent': random.choice(USER_AGENTS)}
-    try:
-        time.sleep(random.uniform(1, 2))
-        response = requests.get(url, headers=headers, timeout=15)
-        return response.text if response.status_code == 200 else None
-    except Exception as e:
-        print(f"Error fetching {url}: {e}")
-        return None
-
-def is_internal_puma_url(url):
-    parsed = urlparse(url)
-    return parsed.netloc == 'cl.puma.com'
-
-def normalize_url(url):
-    parsed = urlparse(url)
-    return urlunparse((parsed.scheme, parsed.netloc, parsed.path, '', '', ''))
-
-def get_page_links(url):
-    html = get_html(url)
-    if not html:
-        return []
-    soup = BeautifulSoup(html, 'lxml')
-    links = []
-    for a in soup.find_all('a', href=True):
-        abs_url = urljoin(url, a['href'])
-        abs_url = normalize_url(abs_url)
-        if is_internal_puma_url(abs_url):
-            links.append(abs_url)
-    return list(set(links))
-
-def load_blacklist():
-    blacklist = set()
-    blacklist_path = SCRIPT_DIR / 'blacklist_url_puma.csv'
-    try:
-        with open(blacklist_path, 'r', encoding='utf-8') as bl_file:
-            for line in bl_file:
-                url = line.strip()
-                if url:
-                    normalized = normalize_url(url)
-                    blacklist.add(normalized)
-        print(f"[INFO] Loaded {len(blacklist)} blacklisted URLs.")
-    except FileNotFoundError:
-        print("[WARNING] Blacklist file not found - proceeding without filtering.")
-    except Exception as e:
-        print(f"[ERROR] Error loading blacklist: {e}")
-    return blacklist
-
-def is_product_url(url):
-    # Match URLs ending with -<digits>-<digits>.html (e.g., ...-397647-03.html)
-    return bool(re.search(r'-\d+-\d+\.html$', url))
-
-def process_urls(input_file, output_file):
-    blacklist = load_blacklist()
-    seen_product_ids = set()  # Track across all input URLs
-    input_path = SCRIPT_DIR / input_file
-    with open(input_path, 'r', encoding='utf-8') as infile:
-        reader = csv.DictReader(infile, skipinitialspace=True)
-        original_headers = [h.strip() for h in reader.fieldnames]
-        rows = list(reader)
-    with open(output_file, 'w', newline='', encoding='utf-8') as outfile:
-        new_headers = original_headers + ['crawled_url', 'category', 'first_encounter', 'datetime']
-        # NOTE: The CSV delimiter is set to ';' (semicolon) intentionally. 
-        # Some tools may expect ',' (comma) as the default delimiter. Adjust as needed.
-        writer = csv.DictWriter(outfile, fieldnames=new_headers, delimiter=';')
-        writer.writeheader()
-        for row in rows:
-            cleaned_row = {k.strip(): v for k, v in row.items()}
-            original_url = cleaned_row.get('url', '')
-            if not original_url:
-                continue
-            base_url = original_url.split('?')[0]
-            unique_links = set()  # Deduplicate per input URL
-            all_crawled_urls = []
-            print(f"\n[PROCESS] Starting URL: {original_url}")
-            for page in range(1, 99):
-                current_url = f"{base_url}?p={page}" if page > 1 else base_url
-                print(f"[PAGE] Processing: {current_url}")
-                crawled_urls = get_page_links(current_url)
-                print(f"[INFO] Found {len(crawled_urls)} links on this page before filtering.")
-                filtered_urls = []
-                for url in crawled_urls:
-                    if url in blacklist:
-                        print(f"[BLACKLISTED] Skipping blacklisted URL: {url}")
-                    else:
-                        filtered_urls.append(url)
-                print(f"[INFO] {len(filtered_urls)} links remain after blacklist filtering.")
-                new_links = [url for url in filtered_urls if url not in unique_links]
-                print(f"[INFO] {len(new_links)} new links found on this page.")
-                if not new_links and page > 1:
-                    print(f"[STOP] No new links found on page {page}, stopping pagination for this URL.")
-                    break
-                unique_links.update(new_links)  # Only add truly new links
-                all_crawled_urls.extend(new_links)  # Only keep truly new links
-            for crawled_url in all_crawled_urls:
-                category = 'product' if is_product_url(crawled_url) else 'not product'
-                first_encounter = ''
-                if category == 'product':
-                    match = re.search(r'-(\d+)-\d+\.html$', crawled_url)
-                    if not match:
-                        # Try to match any digits before .html as fallback
-                        match = re.search(r'(\d+)\.html$', crawled_url)
-                    if match:
-                        product_id = match.group(1)
-                        if product_id not in seen_product_ids:
-                            first_encounter = 'first encounter'
-                            seen_product_ids.add(product_id)
-                new_row = cleaned_row.copy()
-                new_row.update({
-                    'crawled_url': crawled_url,
-                    'category': category,
-                    'first_encounter': first_encounter,
-                    'datetime': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                })
-                writer.writerow(new_row)
-            print(f"[DONE] Finished processing: {original_url}")
-
-if __name__ == "__main__":
-    process_urls("input_urls_puma.csv", output_filepath)
-    print(f"\n[COMPLETE] Crawling completed. Results saved to {output_filepath}")
-    # If the process finished correctly, set output_dir variable
-    output_dir = str(session_html_dir)
-    # Get only the subdirectory part relative to SCRIPT_DIR
-    try:
-        relative_output_dir = Path(output_dir).relative_to(SCRIPT_DIR)
-        relative_path_str = str(relative_output_dir)
-    except ValueError:
-        # Fallback to absolute path if not a subpath
-        relative_path_str = str(output_dir)
-
-    relative_path_str = str(relative_output_dir)
+import os
+import re
+import time
+import random
+import csv
+import argparse
+import logging
+from urllib.parse import urljoin, urlparse, urlunparse
+from datetime import datetime, timezone
+from pathlib import Path
+from collections import defaultdict
+from rate_limiter import HostRateLimiter, parse_retry_after
+from retry_queue import (call_with_retries, error_for_status, is_retryable, error_reason, backoff_delay,
+                         RetryableError, PermanentError, MAX_ATTEMPTS)
+import http_session
+from http_cache import HTTPCache, MAX_CACHE_BYTES, MAX_CACHE_AGE_DAYS
+from checkpoint import CrawlCheckpoint, CHECKPOINT_FILENAME, set_partial_snapshot
+from product_index import StorefrontIndexes, IdBitmap, MAX_PRODUCT_ID_DIGITS
+from blacklist import Blacklist
+from host_scheduler import HostFrontiers
+import storefronts
+import metrics
+from metrics import METRICS
+import sitemap_discovery
+
+log = logging.getLogger('puma.crawl')
+
+# Get absolute path to the directory containing this script
+SCRIPT_DIR = Path(__file__).parent.resolve()
+
+downloaded_htmls_dir = SCRIPT_DIR / 'downloaded_htmls'
+temp_file_path = SCRIPT_DIR / 'temp.txt'
+# Product IDs seen and downloaded across all runs, shared with stage 2
+product_index_dir = downloaded_htmls_dir / 'product_index'
+
+def create_session(session_dir=None):
+    """Create the session directory; returns (directory, output CSV path).
+
+    Without session_dir this is downloaded_htmls/<timestamp>, and temp.txt
+    is pointed at it for the stage scripts run after this one.
+    """
+    # Get timestamp at script start
+    start_time = datetime.now()
+    timestamp_str = start_time.strftime("%Y%m%d%H%M%S")
+    output_filename = f"{timestamp_str}_obtained_urls_puma.csv"
+
+    if session_dir is not None:
+        session_html_dir = Path(session_dir).resolve()
+        session_html_dir.mkdir(parents=True, exist_ok=True)
+        log.info("[SESSION] Session HTML directory: %s", session_html_dir)
+        return session_html_dir, session_html_dir / output_filename
+
+    # Create downloaded_htmls/<timestamp_str> directory for saving HTMLs
+    session_html_dir = downloaded_htmls_dir / timestamp_str
+    session_html_dir.mkdir(parents=True, exist_ok=True)
+    output_filepath = session_html_dir / output_filename
+
+    # Create a temp file named temp.txt
+    with open(temp_file_path, 'w', encoding='utf-8') as temp_file:
+        temp_file.write('Temporary file for process status.\n')
+        temp_file.write(f'output_dir={session_html_dir.relative_to(SCRIPT_DIR)}\n')
+        log.info("[SESSION] Session HTML directory: %s", session_html_dir)
+    return session_html_dir, output_filepath
+
+def resume_session(session_dir=None):
+    """Session directory and crawl CSV of session_dir, or of the run temp.txt points at"""
+    session_html_dir = None
+    if session_dir is not None:
+        session_html_dir = Path(session_dir).resolve()
+    else:
+        with open(temp_file_path, 'r', encoding='utf-8') as temp_file:
+            for line in temp_file:
+                if line.startswith('output_dir='):
+                    session_html_dir = SCRIPT_DIR / line.strip().split('output_dir=')[1].strip()
+                    break
+    if session_html_dir is None or not session_html_dir.is_dir():
+        raise FileNotFoundError(f"No session directory to resume in {session_dir or temp_file_path}")
+    # The session's own crawl CSV; explicit session directories need not be named after a timestamp
+    crawl_csvs = sorted(session_html_dir.glob('[0-9]*_obtained_urls_puma.csv'))
+    if crawl_csvs:
+        output_filepath = crawl_csvs[-1]
+    else:
+        output_filepath = session_html_dir / f"{session_html_dir.name}_obtained_urls_puma.csv"
+    log.info("[SESSION] Resuming session HTML directory: %s", session_html_dir)
+    return session_html_dir, output_filepath
+
+def save_html_content(url, html, session_html_dir):
+    # Create a safe filename from the URL
+    parsed = urlparse(url)
+    safe_path = parsed.path.strip('/').replace('/', '_')
+    if not safe_path:
+        safe_path = 'index'
+    filename = f"{parsed.netloc}_{safe_path}.html"
+    filepath = session_html_dir / filename
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.write(html)
+
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.1 Safari/605.1.15',
+    'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:89.0) Gecko/20100101 Firefox/89.0',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 14_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0 Mobile/15E148 Safari/604.1'
+]
+
+# Starting requests per second per host, the limiter adapts it from there
+REQUESTS_PER_SECOND = 1.0
+RATE_LIMITER = HostRateLimiter(rate=REQUESTS_PER_SECOND)
+# Conditional-GET cache shared with stage 2, set to None to always download in full
+HTTP_CACHE = HTTPCache(downloaded_htmls_dir / 'http_cache')
+
+def fetch_html(url, limiter=RATE_LIMITER):
+    """Page text, raising retry_queue errors on non-200 responses"""
+    headers = {'User-Agent': random.choice(USER_AGENTS)}
+    response = http_session.fetch(url, headers=headers, timeout=15, limiter=limiter, cache=HTTP_CACHE)
+    if response.status_code != 200:
+        raise error_for_status(url, response.status_code, parse_retry_after(response.headers.get('Retry-After')))
+    return response.text
+
+def get_html(url, limiter=RATE_LIMITER):
+    # The crawl reads one page at a time, so retries simply wait inline
+    try:
+        return call_with_retries(fetch_html, url, limiter, max_attempts=MAX_ATTEMPTS)
+    except Exception as e:
+        log.warning("Error fetching %s: %s", url, e)
+        return None
+
+def is_internal_puma_url(url):
+    # Links are followed on the hosts of storefronts.json; bench_pipeline.py adds the mock storefront
+    return storefronts.get_storefronts().for_url(url) is not None
+
+def normalize_url(url):
+    parsed = urlparse(url)
+    return urlunparse((parsed.scheme, parsed.netloc, parsed.path, '', '', ''))
+
+def extract_page_links(url, html):
+    if not html:
+        return []
+    METRICS.inc('pages_total', stage='crawl')
+    # bs4 and lxml are only loaded once there is a page to parse
+    from bs4 import BeautifulSoup
+
+    with METRICS.timer('parse_seconds', stage='crawl'):
+        soup = BeautifulSoup(html, 'lxml')
+        links = []
+        for a in soup.find_all('a', href=True):
+            abs_url = urljoin(url, a['href'])
+            abs_url = normalize_url(abs_url)
+            if is_internal_puma_url(abs_url):
+                links.append(abs_url)
+    return list(set(links))
+
+def get_page_links(url):
+    return extract_page_links(url, get_html(url))
+
+def load_blacklist():
+    """Blacklist rules from blacklist_url_puma.csv: exact URLs plus prefix:, glob: and re: rules"""
+    blacklist_path = SCRIPT_DIR / 'blacklist_url_puma.csv'
+    try:
+        blacklist = Blacklist.load(blacklist_path, normalize=normalize_url)
+        log.info("Loaded %d blacklist rules (%s).", len(blacklist), blacklist.describe())
+        return blacklist
+    except FileNotFoundError:
+        log.warning("Blacklist file not found - proceeding without filtering.")
+    except Exception as e:
+        log.error("Error loading blacklist: %s", e)
+    return Blacklist(normalize=normalize_url)
+
+# Match URLs ending with -<digits>-<digits>.html (e.g., ...-397647-03.html),
+# the first group is the product ID; longer IDs than the product index takes are not products
+PRODUCT_URL_RE = re.compile(rf'-(\d{{1,{MAX_PRODUCT_ID_DIGITS}}})-\d+\.html$')
+
+def is_product_url(url):
+    return bool(PRODUCT_URL_RE.search(url))
+
+# Pages fetched per category are capped at ?p=98, same as the sequential crawl
+MAX_PAGES = 98
+# Defaults for the async crawl mode (--async)
+ASYNC_CONCURRENCY = 16
+ASYNC_PER_HOST = 4
+
+def read_input_rows(input_file):
+    input_path = SCRIPT_DIR / input_file
+    with open(input_path, 'r', encoding='utf-8') as infile:
+        reader = csv.DictReader(infile, skipinitialspace=True)
+        original_headers = [h.strip() for h in reader.fieldnames]
+        rows = list(reader)
+    return original_headers, rows
+
+def filter_new_links(crawled_urls, blacklist, unique_links):
+    """Drop blacklisted and already seen links, keeping the page order"""
+    # Hits are counted by the blacklist and reported once at the end of the run
+    filtered_urls = [url for url in crawled_urls if url not in blacklist]
+    log.debug("%d links remain after blacklist filtering.", len(filtered_urls))
+    new_links = [url for url in filtered_urls if url not in unique_links]
+    log.debug("%d new links found on this page.", len(new_links))
+    return new_links
+
+def new_seen_products(checkpoint=None):
+    """Product IDs tagged as first encounter in this run, one IdBitmap per storefront name"""
+    seen_product_ids = defaultdict(IdBitmap)
+    if checkpoint is not None:
+        stores = storefronts.get_storefronts()
+        for key in checkpoint.seen_products():
+            storefront, product_id = stores.split_product_key(key)
+            if storefront is not None:
+                seen_product_ids[storefront.name].add(product_id)
+    return seen_product_ids
+
+def write_crawled_rows(writer, cleaned_row, all_crawled_urls, seen_product_ids, on_row=None, product_index=None):
+    """Write one row per crawled URL; returns the product keys tagged as first encounter.
+
+    seen_product_ids (see new_seen_products) covers this run; product_index,
+    when given, is the persistent product_index.StorefrontIndexes used to
+    tag first encounters ever. Product IDs are only compared within their
+    storefront, the keys are Storefront.product_key.
+    """
+    stores = storefronts.get_storefronts()
+    new_product_ids = []
+    for crawled_url in all_crawled_urls:
+        # One regex pass gives both the category and the product ID
+        match = PRODUCT_URL_RE.search(crawled_url)
+        category = 'product' if match else 'not product'
+        first_encounter = ''
+        first_encounter_ever = ''
+        if match:
+            product_id = match.group(1)
+            storefront = stores.for_url(crawled_url) or stores.primary
+            seen = seen_product_ids[storefront.name]
+            if product_id not in seen:
+                first_encounter = 'first encounter'
+                seen.add(product_id)
+                new_product_ids.append(storefront.product_key(product_id))
+                if product_index is not None and product_index.get(storefront).mark_seen(product_id):
+                    first_encounter_ever = 'first encounter ever'
+        new_row = cleaned_row.copy()
+        new_row.update({
+            'crawled_url': crawled_url,
+            'category': category,
+            'first_encounter': first_encounter,
+            'first_encounter_ever': first_encounter_ever,
+            'datetime': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        })
+        writer.writerow(new_row)
+        if on_row is not None:
+            on_row(new_row)
+    METRICS.inc('rows_total', len(all_crawled_urls), stage='crawl')
+    return new_product_ids
+
+def open_output_writer(outfile, original_headers, write_header=True):
+    new_headers = original_headers + ['crawled_url', 'category', 'first_encounter', 'first_encounter_ever', 'datetime']
+    # NOTE: The CSV delimiter is set to ';' (semicolon) intentionally. 
+    # Some tools may expect ',' (comma) as the default delimiter. Adjust as needed.
+    writer = csv.DictWriter(outfile, fieldnames=new_headers, delimiter=';')
+    if write_header:
+        writer.writeheader()
+    return writer
+
+def open_output_file(output_file, checkpoint):
+    """Append to the CSV of a resumed session, start a new one otherwise"""
+    resuming = checkpoint is not None and os.path.exists(output_file) and os.path.getsize(output_file) > 0
+    return open(output_file, 'a' if resuming else 'w', newline='', encoding='utf-8'), not resuming
+
+def process_urls(input_file, output_file, on_row=None, checkpoint=None, product_index=None):
+    """Crawl every input category; rows are written, and handed to on_row, page by page.
+
+    With a checkpoint.CrawlCheckpoint, progress is journaled after every page
+    and finished categories or pages from an earlier run are skipped.
+    """
+    blacklist = load_blacklist()
+    # Track across all input URLs
+    seen_product_ids = new_seen_products(checkpoint)
+    original_headers, rows = read_input_rows(input_file)
+    outfile, new_file = open_output_file(output_file, checkpoint)
+    with outfile:
+        writer = open_output_writer(outfile, original_headers, write_header=new_file)
+        for idx, row in enumerate(rows):
+            cleaned_row = {k.strip(): v for k, v in row.items()}
+            original_url = cleaned_row.get('url', '')
+            if not original_url:
+                continue
+            if checkpoint is not None and checkpoint.is_done(idx):
+                log.info("[RESUME] Already finished, skipping: %s", original_url)
+                continue
+            base_url = original_url.split('?')[0]
+            start_page, kept_links = checkpoint.category_state(idx) if checkpoint is not None else (1, [])
+            unique_links = set(kept_links)  # Deduplicate per input URL
+            if start_page > 1:
+                log.info("[RESUME] Continuing %s from page %d", original_url, start_page)
+            log.info("[PROCESS] Starting URL: %s", original_url)
+            for page in range(start_page, MAX_PAGES + 1):
+                current_url = f"{base_url}?p={page}" if page > 1 else base_url
+                log.debug("[PAGE] Processing: %s", current_url)
+                crawled_urls = get_page_links(current_url)
+                log.debug("Found %d links on this page before filtering.", len(crawled_urls))
+                new_links = filter_new_links(crawled_urls, blacklist, unique_links)
+                if not new_links and page > 1:
+                    log.debug("[STOP] No new links found on page %d, stopping pagination for this URL.", page)
+                    break
+                unique_links.update(new_links)  # Only add truly new links
+                # Rows go out as soon as the page is read so downstream stages can start
+                new_product_ids = write_crawled_rows(writer, cleaned_row, new_links, seen_product_ids, on_row,
+                                                     product_index)
+                outfile.flush()
+                if checkpoint is not None:
+                    checkpoint.page_done(idx, original_url, page + 1, new_links, new_product_ids)
+            if checkpoint is not None:
+                checkpoint.category_done(idx, original_url)
+            log.info("[DONE] Finished processing: %s", original_url)
+    log.info("Blacklist: %s", blacklist.format_stats())
+
+# Sitemap discovery mode (--mode sitemap), over the sitemap_url of every storefront unless --sitemap-url is given
+# <lastmod> cut-off per sitemap URL: start time of its last successful run
+sitemap_state_path = downloaded_htmls_dir / 'sitemap_state.json'
+# Product URLs written per batch, the sitemap equivalent of a listing page
+SITEMAP_BATCH = 500
+
+def fetch_sitemap_stream(url, limiter=RATE_LIMITER):
+    """Streamed sitemap response, raising retry_queue errors on non-200 responses"""
+    headers = {'User-Agent': random.choice(USER_AGENTS)}
+    response = http_session.fetch(url, headers=headers, timeout=30, limiter=limiter, stream=True)
+    if response.status_code != 200:
+        response.close()
+        raise error_for_status(url, response.status_code, parse_retry_after(response.headers.get('Retry-After')))
+    return response
+
+def fetch_sitemap(url, limiter=RATE_LIMITER):
+    # Sitemaps are read one at a time, so retries wait inline like get_html's
+    return call_with_retries(fetch_sitemap_stream, url, limiter, max_attempts=MAX_ATTEMPTS)
+
+def process_sitemap(sitemap_urls, input_file, output_file, on_row=None, product_index=None,
+                    changed_only=True, is_internal=is_internal_puma_url):
+    """Discover product URLs from sitemaps instead of paginating category listings.
+
+    Each sitemap (or sitemap index) is streamed, entries go through the same
+    internal-URL, blacklist and product-URL filters as crawled links and are
+    written in the crawl CSV format, with the sitemap URL in the url column.
+    With changed_only, URLs whose <lastmod> is not newer than the last
+    successful run against the same sitemap are skipped. A run only counts
+    as successful when every child sitemap was read; otherwise the cut-off
+    stays where it was, so the next run picks up what this one missed.
+    Returns how many sitemap entries were skipped as unchanged.
+    """
+    blacklist = load_blacklist()
+    seen_product_ids = new_seen_products()
+    original_headers, _ = read_input_rows(input_file)
+    unique_links = set()
+    unchanged = 0
+    with open(output_file, 'w', newline='', encoding='utf-8') as outfile:
+        writer = open_output_writer(outfile, original_headers)
+        for sitemap_url in sitemap_urls:
+            cleaned_row = dict.fromkeys(original_headers, '')
+            cleaned_row['url'] = sitemap_url
+            started_at = datetime.now(timezone.utc)
+            since = sitemap_discovery.load_last_run(sitemap_state_path, sitemap_url) if changed_only else None
+            if since is not None:
+                log.info("Only URLs modified after %s will be kept.", since.isoformat())
+            stats = {'sitemaps': 0, 'urls': 0, 'unchanged': 0, 'failed': 0}
+            counts = {'external': 0, 'blacklisted': 0, 'not product': 0, 'duplicate': 0}
+            kept = len(unique_links)
+            batch = []
+            log.info("[PROCESS] Reading sitemap: %s", sitemap_url)
+
+            def write_batch():
+                write_crawled_rows(writer, cleaned_row, batch, seen_product_ids, on_row, product_index)
+                outfile.flush()
+                batch.clear()
+
+            try:
+                for loc, _ in sitemap_discovery.discover_urls(sitemap_url, fetch_sitemap, since, stats=stats):
+                    url = normalize_url(loc)
+                    if not is_internal(url):
+                        counts['external'] += 1
+                    elif url in blacklist:
+                        counts['blacklisted'] += 1
+                    elif not is_product_url(url):
+                        counts['not product'] += 1
+                    elif url in unique_links:
+                        counts['duplicate'] += 1
+                    else:
+                        unique_links.add(url)
+                        batch.append(url)
+                        if len(batch) >= SITEMAP_BATCH:
+                            write_batch()
+            except sitemap_discovery.READ_ERRORS as e:
+                # One storefront's sitemap failing does not stop the others
+                log.error("🚨 Error reading sitemap %s: %s", sitemap_url, e)
+                stats['failed'] += 1
+            if batch:
+                write_batch()
+            if stats['failed']:
+                log.warning("⚠️ %d sitemaps could not be read; the <lastmod> cut-off of %s is kept",
+                            stats['failed'], sitemap_url)
+            else:
+                sitemap_discovery.save_last_run(sitemap_state_path, sitemap_url, started_at)
+            log.info("Read %d sitemaps, %d URLs listed, %d entries unchanged since the last run.",
+                     stats['sitemaps'], stats['urls'], stats['unchanged'])
+            log.info("Skipped %d external, %d blacklisted, %d non-product and %d duplicate URLs.",
+                     counts['external'], counts['blacklisted'], counts['not product'], counts['duplicate'])
+            log.info("[DONE] %d product URLs kept from %s", len(unique_links) - kept, sitemap_url)
+            unchanged += stats['unchanged']
+    return unchanged
+
+async def fetch_html_async(session, url, global_limit, limiter=RATE_LIMITER):
+    # global_limit caps requests in flight across all hosts; the per-host cap
+    # comes from the host's workers (HostFrontiers), so a request never holds
+    # a global slot while it queues behind its own host
+    headers = {'User-Agent': random.choice(USER_AGENTS)}
+    cache = HTTP_CACHE
+    if cache is not None:
+        headers.update(cache.conditional_headers(url))
+    await limiter.acquire_async(url)
+    async with global_limit:
+        started = time.monotonic()
+        try:
+            async with session.get(url, headers=headers) as response:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                limiter.record(url, response.status, time.monotonic() - started, retry_after)
+                if cache is not None and response.status == 304:
+                    METRICS.record_request(url, response.status, time.monotonic() - started)
+                    body, encoding = cache.load(url)
+                    if body is not None:
+                        cache.revalidated(url)
+                        return body.decode(encoding or 'utf-8', errors='replace')
+                if response.status != 200:
+                    METRICS.record_request(url, response.status, time.monotonic() - started)
+                    raise error_for_status(url, response.status, retry_after)
+                body = await response.read()
+                METRICS.record_request(url, response.status, time.monotonic() - started, len(body))
+                encoding = response.get_encoding()
+                if cache is not None:
+                    cache.store(url, response.headers, body, encoding)
+                return body.decode(encoding, errors='replace')
+        except (RetryableError, PermanentError):
+            raise
+        except Exception as e:
+            limiter.record(url)
+            METRICS.record_request(url, error=e)
+            raise
+
+async def get_html_async(session, url, global_limit, limiter=RATE_LIMITER):
+    # Backoffs only suspend this category's coroutine, the others keep crawling
+    import asyncio
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            return await fetch_html_async(session, url, global_limit, limiter)
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS or not is_retryable(e):
+                log.warning("Error fetching %s: %s", url, e)
+                return None
+            METRICS.inc('retries_total', reason=error_reason(e))
+            await asyncio.sleep(backoff_delay(attempt, getattr(e, 'retry_after', None)))
+
+async def crawl_category_async(session, base_url, blacklist, global_limit, start_page=1, kept_links=(),
+                               on_page=None):
+    # Pages of one category stay sequential so the "no new links" stop rule
+    # sees them in order; concurrency comes from crawling categories side by side
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    unique_links = set(kept_links)
+    all_crawled_urls = list(kept_links)
+    for page in range(start_page, MAX_PAGES + 1):
+        current_url = f"{base_url}?p={page}" if page > 1 else base_url
+        log.debug("[PAGE] Processing: %s", current_url)
+        html = await get_html_async(session, current_url, global_limit)
+        # lxml parsing is CPU bound, keep it off the event loop
+        crawled_urls = await loop.run_in_executor(None, extract_page_links, current_url, html)
+        log.debug("Found %d links on %s before filtering.", len(crawled_urls), current_url)
+        new_links = filter_new_links(crawled_urls, blacklist, unique_links)
+        if not new_links and page > 1:
+            log.debug("[STOP] No new links found on page %d of %s, stopping pagination.", page, base_url)
+            break
+        unique_links.update(new_links)
+        all_crawled_urls.extend(new_links)
+        if on_page is not None:
+            on_page(page + 1, new_links)
+    return all_crawled_urls
+
+async def process_urls_async(input_file, output_file, concurrency=ASYNC_CONCURRENCY, per_host=ASYNC_PER_HOST,
+                             on_row=None, checkpoint=None, product_index=None):
+    """Crawl the input categories concurrently, with a frontier and a worker pool per host.
+
+    Each host crawls up to its storefront's concurrency (else per_host)
+    categories at a time, at its own rate, and concurrency caps requests in
+    flight over all hosts; a slow storefront only holds up its own
+    categories.
+    """
+    import asyncio
+
+    stores = storefronts.get_storefronts()
+    blacklist = load_blacklist()
+    seen_product_ids = new_seen_products(checkpoint)
+    original_headers, rows = read_input_rows(input_file)
+    categories = []
+    for idx, row in enumerate(rows):
+        cleaned_row = {k.strip(): v for k, v in row.items()}
+        if not cleaned_row.get('url', ''):
+            continue
+        if checkpoint is not None and checkpoint.is_done(idx):
+            log.info("[RESUME] Already finished, skipping: %s", cleaned_row['url'])
+            continue
+        categories.append((idx, cleaned_row))
+
+    global_limit = asyncio.Semaphore(concurrency)
+    frontiers = HostFrontiers(lambda host: stores.concurrency(host, per_host))
+    # The connector's per-host cap must not undercut a storefront's own concurrency
+    host_limit = max([per_host] + [storefront.concurrency or 0 for storefront in stores])
+    session, reuse_stats = http_session.create_async_session(concurrency, host_limit)
+    async with session:
+        by_host = {}
+        for idx, cleaned_row in categories:
+            base_url = cleaned_row['url'].split('?')[0]
+            start_page, kept_links = checkpoint.category_state(idx) if checkpoint is not None else (1, [])
+            on_page = None
+            if checkpoint is not None:
+                # Links are journaled per page; rows are only written once the category is complete
+                def on_page(next_page, new_links, idx=idx, url=cleaned_row['url']):
+                    checkpoint.page_done(idx, url, next_page, new_links)
+            log.info("[PROCESS] Queued URL: %s", cleaned_row['url'])
+            host = urlparse(base_url).netloc
+            future = frontiers.add(host, crawl_category_async, session, base_url, blacklist, global_limit,
+                                   start_page, kept_links, on_page)
+            by_host.setdefault(host, []).append((idx, cleaned_row, future))
+        outfile, new_file = open_output_file(output_file, checkpoint)
+        with outfile:
+            writer = open_output_writer(outfile, original_headers, write_header=new_file)
+
+            async def write_host(entries):
+                # Categories of a host are written in input order so first_encounter
+                # tagging matches the sequential crawl; hosts do not wait for each other
+                for idx, cleaned_row, future in entries:
+                    all_crawled_urls = await future
+                    new_product_ids = write_crawled_rows(writer, cleaned_row, all_crawled_urls, seen_product_ids,
+                                                         on_row, product_index)
+                    outfile.flush()
+                    if checkpoint is not None:
+                        checkpoint.category_done(idx, cleaned_row['url'], new_product_ids)
+                    log.info("[DONE] Finished processing: %s", cleaned_row['url'])
+
+            await asyncio.gather(frontiers.run(), *(write_host(entries) for entries in by_host.values()))
+    log.info("Blacklist: %s", blacklist.format_stats())
+    log.info("HTTP: %s", http_session.format_stats(reuse_stats))
+
+def add_arguments(parser):
+    """Options of the crawl stage, shared by this script and puma_cli.py"""
+    parser.add_argument('--input', default="input_urls_puma.csv",
+                        help="category URL CSV, relative to this script unless absolute")
+    parser.add_argument('--session-dir', default=None,
+                        help="session directory to create or resume (default: a new downloaded_htmls/<timestamp>, "
+                             "recorded in temp.txt)")
+    parser.add_argument('--mode', choices=('listing', 'sitemap'), default='listing',
+                        help="discover product URLs by paginating category listings or from the sitemap")
+    parser.add_argument('--sitemap-url', default=None,
+                        help="sitemap or sitemap index to read in sitemap mode (default: every storefront's)")
+    parser.add_argument('--all-sitemap-urls', action='store_true',
+                        help="keep sitemap URLs even if their <lastmod> predates the last run")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="crawl categories concurrently with a pooled async HTTP client")
+    parser.add_argument('--concurrency', type=int, default=ASYNC_CONCURRENCY,
+                        help="maximum requests in flight across all hosts (async mode)")
+    parser.add_argument('--per-host', type=int, default=ASYNC_PER_HOST,
+                        help="maximum requests in flight per host, unless its storefront sets concurrency (async mode)")
+    parser.add_argument('--rate', type=float, default=REQUESTS_PER_SECOND,
+                        help="starting requests per second per host, unless its storefront sets requests_per_second; "
+                             "adapted on 429/503 and latency")
+    parser.add_argument('--pool-size', type=int, default=http_session.POOL_SIZE,
+                        help="keep-alive connections per host in the crawler's session")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue the session (--session-dir, else temp.txt) from its checkpoint "
+                             "instead of starting a new one")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="skip the conditional-GET cache and download every page in full")
+    parser.add_argument('--cache-max-mb', type=int, default=MAX_CACHE_BYTES // 1024 ** 2,
+                        help="evict the oldest cache entries beyond this size")
+    parser.add_argument('--cache-max-age-days', type=float, default=MAX_CACHE_AGE_DAYS,
+                        help="evict cache entries not revalidated for this many days")
+    storefronts.add_arguments(parser)
+
+def run(args):
+    """Crawl with the parsed command-line options; returns the session directory"""
+    global HTTP_CACHE
+    stores = storefronts.configure(args.storefronts)
+    if args.resume:
+        session_html_dir, output_filepath = resume_session(args.session_dir)
+    else:
+        session_html_dir, output_filepath = create_session(args.session_dir)
+    # Always journal progress so any run can be resumed with --resume
+    checkpoint = CrawlCheckpoint(session_html_dir / CHECKPOINT_FILENAME)
+    if not args.resume:
+        # A fresh run in an existing session directory must not inherit its journal
+        checkpoint.reset()
+    if args.mode != 'sitemap':
+        crawl_mode = 'async' if args.use_async else 'sequential'
+        journaled_mode = checkpoint.crawl_mode()
+        if journaled_mode not in (None, crawl_mode):
+            checkpoint.close()
+            raise ValueError(f"{session_html_dir} was crawled in {journaled_mode} mode, "
+                             f"resume it in the same mode")
+        checkpoint.set_crawl_mode(crawl_mode)
+    product_index = StorefrontIndexes(product_index_dir)
+    RATE_LIMITER.rate = args.rate
+    stores.apply_rates(RATE_LIMITER)
+    http_session.configure(pool_size=args.pool_size)
+    if args.no_cache:
+        HTTP_CACHE = None
+    else:
+        HTTP_CACHE.max_bytes = args.cache_max_mb * 1024 ** 2
+        HTTP_CACHE.max_age = args.cache_max_age_days * 86400
+    partial = None
+    if args.mode == 'sitemap':
+        sitemap_urls = [args.sitemap_url] if args.sitemap_url else [storefront.sitemap_url for storefront in stores]
+        unchanged = process_sitemap(sitemap_urls, args.input, output_filepath,
+                                    product_index=product_index, changed_only=not args.all_sitemap_urls)
+        if unchanged:
+            partial = f"{unchanged} sitemap entries unchanged since the last run were skipped"
+        log.info("HTTP: %s", http_session.format_stats(http_session.connection_stats()))
+    elif args.use_async:
+        import asyncio
+
+        asyncio.run(process_urls_async(args.input, output_filepath,
+                                       concurrency=args.concurrency, per_host=args.per_host,
+                                       checkpoint=checkpoint, product_index=product_index))
+    else:
+        process_urls(args.input, output_filepath, checkpoint=checkpoint, product_index=product_index)
+        log.info("HTTP: %s", http_session.format_stats(http_session.connection_stats()))
+    # Products skipped as unchanged are not reported as removed by stage 4
+    set_partial_snapshot(session_html_dir, 'crawl', partial)
+    checkpoint.close()
+    product_index.close()
+    if HTTP_CACHE is not None:
+        log.info("Cache: %s, %d entries evicted", HTTP_CACHE.format_stats(), HTTP_CACHE.prune())
+    log.info("[COMPLETE] Crawling completed. Results saved to %s", output_filepath)
+    return session_html_dir
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crawl Puma category pages and collect product URLs.")
+    add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    finish_metrics = metrics.setup(args)
+    run(args)
+    finish_metrics()
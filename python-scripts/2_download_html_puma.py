@@ -1,199 +1,494 @@
-import csv
-import os
-import re
-import time
-import random
-import requests
-import sys
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import sys
-
-USER_AGENTS = [
-    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
-    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.1 Safari/605.1.15',
-    'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:89.0) Gecko/20100101 Firefox/89.0',
-    'Mozilla/5.0 (iPhone; CPU iPhone OS 14_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0 Mobile/15E148 Safari/604.1'
-]
-
-def get_output_dir():
-    """Get output directory from temp.txt in script directory"""
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    temp_file = os.path.join(script_dir, "temp.txt")
-    output_dir = None
-    try:
-        with open(temp_file, "r") as f:
-            for line in f:
-                if line.startswith("output_dir="):
-                    output_dir = line.strip().split("output_dir=")[1].strip()
-                    print(f"📂 Output directory variable found: {output_dir}")
-                    print(f"📍 Directory path: {output_dir}")
-                    print(f"\nOutput directory: {output_dir}")  # Added explicit print
-                    break
-        if output_dir is None:
-            print("⚠️ No 'output_dir' variable found in temp.txt")
-        return output_dir
-    except FileNotFoundError:
-        print("⚠️ temp.txt not found in script directory")
-        return None
-
-def get_product_id(url):
-    """Extract base product ID from URL"""
-    match = re.search(r'-(\d+)-\d+\.html$', url)
-    return match.group(1) if match else None
-
-def sanitize_filename(url):
-    """Create safe filename from URL"""
-    return re.sub(r'[^a-zA-Z0-9-]', '_', url.split('/')[-1].split('.')[0])
-
-def download_html_task(args, sleep_delay=True):
-    url, referer, output_folder = args
-    headers = {
-        'User-Agent': random.choice(USER_AGENTS),
-        'Referer': referer,
-        'Accept-Language': 'en-US,en;q=0.9',
-        'Accept-Encoding': 'gzip, deflate',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-        'Connection': 'keep-alive'
-    }
-    product_id = get_product_id(url)
-    if product_id:
-        filename = f"{product_id}.html"
-    else:
-        filename = sanitize_filename(url) + ".html"
-    filepath = os.path.join(output_folder, filename)
-    if os.path.exists(filepath):
-        print(f"⚠️ ALERT: File already exists and will be skipped: {filename}")
-        return (filename, filepath, url, True)
-    try:
-        if sleep_delay:
-            time.sleep(random.uniform(1, 3))  # anti-bot delay
-        response = requests.get(url, headers=headers, timeout=15)
-        if response.status_code == 200:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(response.text)
-            print(f"✅ Downloaded: {filename}")
-            return (filename, filepath, url, False)
-        else:
-            print(f"⚠️ Failed to download: {url} (Status {response.status_code})")
-            return (None, None, url, False)
-    except Exception as e:
-        print(f"🚨 Error downloading {url}: {e}")
-        return (None, None, url, False)
-
-def find_latest_csv():
-    """Find the most recent obtained_urls_puma CSV file from output directory"""
-    csv_files = []
-    # Get output directory from temp.txt
-    output_dir_candidate = get_output_dir()
-    if output_dir_candidate is None:
-        print("⚠️ Output directory not found!")
-        sys.exit()
-    if os.path.isabs(output_dir_candidate):
-        output_dir = output_dir_candidate
-    else:
-        output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), output_dir_candidate)
-    if not output_dir or not os.path.isdir(output_dir):
-        print("⚠️ Invalid output directory!")
-        sys.exit()
-        exit()
-
-    # Look for CSV files in the output directory
-    pattern = re.compile(r'^(\d{14})_obtained_urls_puma.*\.csv$')
-    for filename in os.listdir(output_dir):
-        match = pattern.match(filename)
-        if match:
-            try:
-                timestamp = datetime.strptime(match.group(1), '%Y%m%d%H%M%S')
-                csv_files.append((timestamp, os.path.join(output_dir, filename)))
-            except ValueError:
-                continue
-        if not csv_files:
-            print("⚠️ No matching CSV files found!")
-            print("Files must be named: yyyymmddhhmmss_obtained_urls_puma[...].csv")
-            sys.exit()
-            exit()
-
-    # Sort descending by timestamp
-    csv_files.sort(reverse=True, key=lambda x: x[0])
-    latest_file = csv_files[0][1]
-    print(f"🔍 Found {len(csv_files)} matching CSV files")
-    print(f"✅ Selected latest file: {latest_file}")
-    return latest_file
-
-def main():
-    # Find latest CSV automatically
-    input_csv = find_latest_csv()
-    # Create output folder in the same directory as this script
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    # Use the folder where input_csv is located
-    input_csv_dir = os.path.dirname(os.path.abspath(input_csv))
-    output_folder = os.path.join(input_csv_dir, "htmls")
-    os.makedirs(output_folder, exist_ok=True)
-    # Output CSV path
-    output_csv = os.path.join(output_folder, "complete_data.csv")
-
-    # Gather download tasks and rows to write
-    tasks = []
-    rows_to_write = []
-    task_row_indices = []
-    with open(input_csv, 'r', encoding='utf-8') as f_in:
-        reader = csv.DictReader(f_in, delimiter=';')
-        fieldnames = list(reader.fieldnames)
-        if 'html_filename' not in fieldnames:
-            fieldnames.append('html_filename')
-        if 'html_filepath' not in fieldnames:
-            fieldnames.append('html_filepath')
-        rows = list(reader)
-        for row in rows:
-            first_encounter_value = str(row.get('first_encounter', '')).strip().lower()
-            if first_encounter_value == 'first encounter':
-                crawled_url = row['crawled_url']
-                referer_url = row['url']
-                tasks.append((crawled_url, referer_url, output_folder))
-                rows_to_write.append(row)
-                rows_to_write.append(row)
-    # Download in parallel with batching to avoid high memory usage
-    max_workers = min(8, os.cpu_count() or 4)
-    batch_size = 100  # Adjust batch size as needed for your memory constraints
-    for batch_start in range(0, len(tasks), batch_size):
-        batch_end = min(batch_start + batch_size, len(tasks))
-        batch_tasks = tasks[batch_start:batch_end]
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_rowidx = {
-                executor.submit(download_html_task, batch_tasks[i], False): batch_start + i
-                for i in range(len(batch_tasks))
-            }
-            for future in as_completed(future_to_rowidx):
-                row_idx = future_to_rowidx[future]
-                filename, filepath, _, _ = future.result()
-                if filename and filepath:
-                    rows_to_write[row_idx]['html_filename'] = filename
-                    rows_to_write[row_idx]['html_filepath'] = filepath
-                else:
-                    rows_to_write[row_idx]['html_filename'] = ''
-                    rows_to_write[row_idx]['html_filepath'] = ''
-                rows_to_write[row_idx]['html_filepath'] = ''
-    # Write output CSV
-    with open(output_csv, 'w', newline='', encoding='utf-8') as f_out:
-        writer = csv.DictWriter(f_out, fieldnames=fieldnames, delimiter=';')
-        writer.writeheader()
-        for row in rows_to_write:
-            writer.writerow(row)
-
-    print(f"\nProcessing complete! Results saved to:\n{output_csv}")
-    # Write output_dir_htmls to temp.txt
-    relative_output_folder = os.path.relpath(output_folder, script_dir)
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    temp_file = os.path.join(script_dir, "temp.txt")
-    with open(temp_file, "a") as f:
-        f.write(f"\noutput_dir_htmls={relative_output_folder}")
-
-    output_dir = get_output_dir()
-    if output_dir:
-        print(f"\n[INFO] Output directory from temp.txt: {output_dir}\n")
-    else:
-        print("\n[INFO] No output directory found in temp.txt\n")
-
-if __name__ == "__main__":
-    main()
+import csv
+import os
+import re
+import random
+import argparse
+import logging
+import sys
+from datetime import datetime
+from collections import deque
+from urllib.parse import urlparse
+from rate_limiter import HostRateLimiter, parse_retry_after
+from retry_queue import (RetryScheduler, DeadLetterFile, read_dead_letters, error_for_status, call_with_retries,
+                         RetryableError, PermanentError, MAX_ATTEMPTS, DEAD_LETTER_FILENAME)
+import http_session
+from html_store import HTMLPackStore
+from checkpoint import CrawlCheckpoint, CHECKPOINT_FILENAME, set_partial_snapshot
+from product_index import StorefrontIndexes, MAX_PRODUCT_ID_DIGITS
+from host_scheduler import HostPoolExecutor
+import storefronts
+from http_cache import HTTPCache, MAX_CACHE_BYTES, MAX_CACHE_AGE_DAYS
+import metrics
+from metrics import METRICS
+
+log = logging.getLogger('puma.download')
+
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.1 Safari/605.1.15',
+    'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:89.0) Gecko/20100101 Firefox/89.0',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 14_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0 Mobile/15E148 Safari/604.1'
+]
+
+# Starting requests per second per host, shared by all download threads and
+# adapted on 429/503 and latency
+REQUESTS_PER_SECOND = 2.0
+RATE_LIMITER = HostRateLimiter(rate=REQUESTS_PER_SECOND)
+# Conditional-GET cache shared with stage 1, set to None to always download in full
+HTTP_CACHE = HTTPCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'downloaded_htmls', 'http_cache'))
+
+# Compressed, deduplicated page store shared by all runs (--store pack)
+PACK_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'downloaded_htmls', 'store')
+# Product IDs seen and downloaded across all runs, shared with stage 1
+PRODUCT_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'downloaded_htmls', 'product_index')
+# Download threads per host (unless its storefront sets a concurrency), and how
+# many rows per thread may be queued or waiting to be written
+MAX_WORKERS = min(8, os.cpu_count() or 4)
+WINDOW_PER_WORKER = 4
+
+def get_output_dir():
+    """Get output directory from temp.txt in script directory"""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    temp_file = os.path.join(script_dir, "temp.txt")
+    output_dir = None
+    try:
+        with open(temp_file, "r") as f:
+            for line in f:
+                if line.startswith("output_dir="):
+                    output_dir = line.strip().split("output_dir=")[1].strip()
+                    log.info("📂 Output directory variable found: %s", output_dir)
+                    break
+        if output_dir is None:
+            log.warning("⚠️ No 'output_dir' variable found in temp.txt")
+        return output_dir
+    except FileNotFoundError:
+        log.warning("⚠️ temp.txt not found in script directory")
+        return None
+
+# Product ID of a product URL, as long as the product index can hold it
+PRODUCT_URL_RE = re.compile(rf'-(\d{{1,{MAX_PRODUCT_ID_DIGITS}}})-\d+\.html$')
+
+def get_product_id(url):
+    """Extract base product ID from URL"""
+    match = PRODUCT_URL_RE.search(url)
+    return match.group(1) if match else None
+
+def storefront_of(url):
+    """Storefront serving url; pages of unknown hosts are filed under the primary one"""
+    stores = storefronts.get_storefronts()
+    return stores.for_url(url) or stores.primary
+
+def task_host(task, **kwargs):
+    """Host a download task goes to, for HostPoolExecutor"""
+    return urlparse(task[0]).netloc
+
+def sanitize_filename(url):
+    """Create safe filename from URL"""
+    return re.sub(r'[^a-zA-Z0-9-]', '_', url.split('/')[-1].split('.')[0])
+
+def download_html_attempt(args, limiter=RATE_LIMITER, store=None):
+    """One try at a product page; returns (filename, filepath, url, existed).
+
+    Failures raise retry_queue.RetryableError / PermanentError (or the
+    request's own exception) so a RetryScheduler can decide what to do.
+    """
+    url, referer, output_folder = args
+    headers = {
+        'User-Agent': random.choice(USER_AGENTS),
+        'Referer': referer,
+        'Accept-Language': 'en-US,en;q=0.9',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    }
+    product_id = get_product_id(url)
+    if product_id:
+        filename = f"{storefront_of(url).product_key(product_id)}.html"
+    else:
+        filename = sanitize_filename(url) + ".html"
+    if store is not None:
+        filepath = store.location(filename)
+        exists = store.contains(filename)
+    else:
+        filepath = os.path.join(output_folder, filename)
+        exists = os.path.exists(filepath)
+    if exists:
+        log.debug("⚠️ File already exists and will be skipped: %s", filename)
+        METRICS.inc('downloads_total', result='exists')
+        return (filename, filepath, url, True)
+    # Pooled keep-alive session per thread, limiter is the anti-bot delay
+    response = http_session.fetch(url, headers=headers, timeout=15, limiter=limiter, cache=HTTP_CACHE)
+    if response.status_code != 200:
+        raise error_for_status(url, response.status_code, parse_retry_after(response.headers.get('Retry-After')))
+    if store is not None:
+        store.put(filename, url, response.text)
+    else:
+        with open(filepath, 'w', encoding='utf-8') as f:
+            f.write(response.text)
+    if response.from_cache:
+        log.debug("♻️ Not modified, reused cached copy: %s", filename)
+        METRICS.inc('downloads_total', result='not_modified')
+    else:
+        log.debug("✅ Downloaded: %s", filename)
+        METRICS.inc('downloads_total', result='downloaded')
+    METRICS.inc('pages_total', stage='download')
+    return (filename, filepath, url, False)
+
+def failed_download(url, error):
+    """Result row values for a page that could not be downloaded"""
+    if isinstance(error, (RetryableError, PermanentError)):
+        log.warning("⚠️ Failed to download: %s", error)
+        METRICS.inc('downloads_total', result='failed')
+    else:
+        log.error("🚨 Error downloading %s: %s", url, error)
+        METRICS.inc('downloads_total', result='error')
+    return (None, None, url, False)
+
+def download_html_task(args, limiter=RATE_LIMITER, store=None, max_attempts=MAX_ATTEMPTS, dead_letter=None,
+                       row=None):
+    """Download with inline retries, for callers that run one download per thread.
+
+    Timeouts, 429 and 5xx are retried up to max_attempts; a page that still
+    fails is reported as (None, None, url, False) and, given a
+    retry_queue.DeadLetterFile, recorded there with its crawl row for
+    --replay-dead-letter.
+    """
+    attempts = [0]
+
+    def attempt():
+        attempts[0] += 1
+        return download_html_attempt(args, limiter, store)
+
+    try:
+        return call_with_retries(attempt, max_attempts=max_attempts)
+    except Exception as e:
+        if dead_letter is not None:
+            dead_letter.add({'url': args[0], 'referer': args[1], 'row': row or {}}, e, attempts[0])
+        return failed_download(args[0], e)
+
+def finish_dead_letter(dead_letter, dead_letter_path):
+    """Move this run's dead letters (written to a .new file) into place, or clear the old ones"""
+    if dead_letter.count:
+        os.replace(dead_letter.path, dead_letter_path)
+        log.warning("💀 %d downloads still failing, listed in %s (replay with --replay-dead-letter)",
+                    dead_letter.count, dead_letter_path)
+    elif os.path.exists(dead_letter_path):
+        os.remove(dead_letter_path)
+
+def find_latest_csv(session_dir=None):
+    """Find the most recent obtained_urls_puma CSV file of session_dir, or of the output directory in temp.txt"""
+    csv_files = []
+    # Get output directory from temp.txt unless it was given
+    output_dir_candidate = os.path.abspath(session_dir) if session_dir is not None else get_output_dir()
+    if output_dir_candidate is None:
+        log.error("⚠️ Output directory not found!")
+        sys.exit()
+    if os.path.isabs(output_dir_candidate):
+        output_dir = output_dir_candidate
+    else:
+        output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), output_dir_candidate)
+    if not output_dir or not os.path.isdir(output_dir):
+        log.error("⚠️ Invalid output directory!")
+        sys.exit()
+
+    # Look for CSV files in the output directory
+    pattern = re.compile(r'^(\d{14})_obtained_urls_puma.*\.csv$')
+    for filename in os.listdir(output_dir):
+        match = pattern.match(filename)
+        if match:
+            try:
+                timestamp = datetime.strptime(match.group(1), '%Y%m%d%H%M%S')
+                csv_files.append((timestamp, os.path.join(output_dir, filename)))
+            except ValueError:
+                continue
+    if not csv_files:
+        log.error("⚠️ No matching CSV files found! Files must be named: "
+                  "yyyymmddhhmmss_obtained_urls_puma[...].csv")
+        sys.exit()
+
+    # Sort descending by timestamp
+    csv_files.sort(reverse=True, key=lambda x: x[0])
+    latest_file = csv_files[0][1]
+    log.info("🔍 Found %d matching CSV files", len(csv_files))
+    log.info("✅ Selected latest file: %s", latest_file)
+    return latest_file
+
+def is_first_encounter(row):
+    return str(row.get('first_encounter', '')).strip().lower() == 'first encounter'
+
+def iter_download_rows(reader, output_folder, product_index=None, refresh_days=None, skipped=None, host=None,
+                       finished=()):
+    """Yield (row, task) for every first-encounter row (of host, if given), reading the CSV lazily.
+
+    With refresh_days, products the index saw downloaded less than that many
+    days ago are left out (and counted in skipped['fresh']), except the URLs
+    in finished: a resumed run downloaded those itself, today.
+    """
+    for row in reader:
+        if is_first_encounter(row):
+            crawled_url = row['crawled_url']
+            if host is not None and urlparse(crawled_url).netloc != host:
+                continue
+            referer_url = row['url']
+            product_id = get_product_id(crawled_url)
+            if (refresh_days is not None and product_id and crawled_url not in finished
+                    and not product_index.get(storefront_of(crawled_url)).is_due(product_id, refresh_days)):
+                skipped['fresh'] += 1
+                continue
+            yield row, (crawled_url, referer_url, output_folder)
+
+def csv_hosts(reader):
+    """Hosts of a crawl CSV's first-encounter rows, in order of first appearance"""
+    hosts = {}
+    for row in reader:
+        if is_first_encounter(row):
+            hosts.setdefault(urlparse(row['crawled_url']).netloc, None)
+    return list(hosts)
+
+def write_result(writer, row, future, checkpoint=None, product_index=None):
+    filename, filepath, url, _ = future.result()
+    row['html_filename'] = filename or ''
+    row['html_filepath'] = filepath or ''
+    writer.writerow(row)
+    METRICS.inc('rows_total', stage='download')
+    if filename:
+        if checkpoint is not None:
+            checkpoint.download_done(url, filename, filepath)
+        product_id = get_product_id(url)
+        if product_index is not None and product_id:
+            product_index.get(storefront_of(url)).mark_fetched(product_id)
+
+def finished_future(result):
+    from concurrent.futures import Future
+
+    future = Future()
+    future.set_result(result)
+    return future
+
+def iter_dead_letter_rows(records, output_folder):
+    """Yield (row, task) for every download recorded in a dead-letter file"""
+    for record in records:
+        yield record['row'], (record['url'], record['referer'], output_folder)
+
+def rows_not_replayed(csv_path, replayed_urls):
+    """Rows of an existing complete_data.csv, minus the failed rows of the downloads being replayed"""
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f, delimiter=';'):
+            if row.get('html_filename') or row.get('crawled_url') not in replayed_urls:
+                yield row
+
+def read_header(csv_path):
+    """Column names of an existing ';' CSV, None if it is missing or empty"""
+    if not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0:
+        return None
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        return next(csv.reader(f, delimiter=';'), None)
+
+def main(max_workers=MAX_WORKERS, window=None, use_pack=False, resume=False, refresh_days=None,
+         max_attempts=MAX_ATTEMPTS, replay_dead_letter=None, session_dir=None):
+    """Download every first-encounter product of the latest crawl of session_dir (default: temp.txt's).
+
+    Timeouts, 429 and 5xx responses are retried with backoff up to
+    max_attempts; downloads that still fail are listed in the session's
+    dead_letter.jsonl. With replay_dead_letter (a dead-letter path, or ''
+    for the latest session's), only those downloads are tried again and
+    their rows appended to complete_data.csv; the ones still failing are
+    left in the dead-letter file.
+    """
+    if replay_dead_letter is not None:
+        dead_letter_path = replay_dead_letter or os.path.join(
+            os.path.dirname(os.path.abspath(find_latest_csv(session_dir))), DEAD_LETTER_FILENAME)
+        input_csv_dir = os.path.dirname(os.path.abspath(dead_letter_path))
+        records = read_dead_letters(dead_letter_path)
+        log.info("🔁 Replaying %d dead-lettered downloads from %s", len(records), dead_letter_path)
+        # Failures of the replay replace the file once it is done
+        dead_letter = DeadLetterFile(dead_letter_path + '.new')
+    else:
+        # Find latest CSV automatically
+        input_csv = find_latest_csv(session_dir)
+        # Use the folder where input_csv is located
+        input_csv_dir = os.path.dirname(os.path.abspath(input_csv))
+        dead_letter_path = os.path.join(input_csv_dir, DEAD_LETTER_FILENAME)
+        dead_letter = DeadLetterFile(dead_letter_path + '.new')
+    # Create output folder in the same directory as this script
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    output_folder = os.path.join(input_csv_dir, "htmls")
+    os.makedirs(output_folder, exist_ok=True)
+    # Output CSV path
+    output_csv = os.path.join(output_folder, "complete_data.csv")
+    # Pages go to the shared pack under the session (timestamp) directory name
+    store = HTMLPackStore(PACK_STORE_DIR, os.path.basename(input_csv_dir)) if use_pack else None
+    # Finished downloads are journaled next to stage 1's crawl checkpoint
+    checkpoint = CrawlCheckpoint(os.path.join(input_csv_dir, CHECKPOINT_FILENAME))
+    finished = checkpoint.finished_downloads() if resume else {}
+    if finished:
+        log.info("⏩ Resuming: %d downloads already finished", len(finished))
+    product_index = StorefrontIndexes(PRODUCT_INDEX_DIR)
+    skipped = {'fresh': 0}
+
+    # One row cursor (frontier) per host, so every host's downloads are fed
+    # and written independently of how fast the other hosts answer
+    inputs = []
+    if replay_dead_letter is not None:
+        by_host = {}
+        for record in records:
+            by_host.setdefault(urlparse(record['url']).netloc, []).append(record)
+        frontiers = {host: iter_dead_letter_rows(host_records, output_folder)
+                     for host, host_records in by_host.items()}
+        existing_header = read_header(output_csv)
+        fieldnames = existing_header or (list(records[0]['row']) if records else [])
+        # complete_data.csv is rewritten without the failed rows being replayed,
+        # their new results go at the end
+        f_out = open(output_csv + '.new', 'w', newline='', encoding='utf-8')
+    else:
+        with open(input_csv, 'r', encoding='utf-8') as f_in:
+            reader = csv.DictReader(f_in, delimiter=';')
+            fieldnames = list(reader.fieldnames or [])
+            hosts = csv_hosts(reader)
+        frontiers = {}
+        for host in hosts:
+            inputs.append(open(input_csv, 'r', encoding='utf-8'))
+            frontiers[host] = iter_download_rows(csv.DictReader(inputs[-1], delimiter=';'), output_folder,
+                                                 product_index, refresh_days, skipped, host, finished)
+        existing_header = None
+        f_out = open(output_csv, 'w', newline='', encoding='utf-8')
+    with f_out:
+        if 'html_filename' not in fieldnames:
+            fieldnames.append('html_filename')
+        if 'html_filepath' not in fieldnames:
+            fieldnames.append('html_filepath')
+        writer = csv.DictWriter(f_out, fieldnames=fieldnames, delimiter=';')
+        writer.writeheader()
+        if existing_header:
+            writer.writerows(rows_not_replayed(output_csv, {record['url'] for record in records}))
+        # Per host, downloads in flight or finished but not yet written; bounds
+        # memory while keeping the host's workers busy behind a slow download
+        pending = {host: deque() for host in frontiers}
+        METRICS.gauge_callback('queue_depth', lambda: sum(map(len, pending.values())), queue='download_window')
+        stores = storefronts.get_storefronts()
+
+        def workers_for(host):
+            return stores.concurrency(host, max_workers)
+
+        def submit(row, task):
+            url = task[0]
+            if url in finished:
+                return finished_future(finished[url] + (url, True))
+            return scheduler.submit(
+                download_html_attempt, task, store=store,
+                fallback=lambda error: failed_download(url, error),
+                record={'url': url, 'referer': task[1], 'row': row})
+
+        from concurrent.futures import wait, FIRST_COMPLETED
+
+        with HostPoolExecutor(task_host, workers_for) as executor:
+            # Retries wait on the scheduler's timer, not in a worker thread
+            scheduler = RetryScheduler(executor, max_attempts=max_attempts, dead_letter=dead_letter)
+            while frontiers or any(pending.values()):
+                for host in list(frontiers):
+                    host_window = window or workers_for(host) * WINDOW_PER_WORKER
+                    while len(pending[host]) < host_window:
+                        item = next(frontiers[host], None)
+                        if item is None:
+                            del frontiers[host]
+                            break
+                        pending[host].append((item[0], submit(*item)))
+                # Each host's rows go out in input order, as soon as the head of its window is done
+                written = 0
+                for host_pending in pending.values():
+                    while host_pending and host_pending[0][1].done():
+                        write_result(writer, *host_pending.popleft(), checkpoint, product_index)
+                        written += 1
+                if not written:
+                    wait([host_pending[0][1] for host_pending in pending.values() if host_pending],
+                         return_when=FIRST_COMPLETED)
+            scheduler.close()
+    for f_in in inputs:
+        f_in.close()
+    if replay_dead_letter is not None:
+        os.replace(output_csv + '.new', output_csv)
+    finish_dead_letter(dead_letter, dead_letter_path)
+    checkpoint.close()
+    product_index.close()
+    if refresh_days is not None:
+        log.info("🗓️ %d products skipped, downloaded less than %d days ago", skipped['fresh'], refresh_days)
+    if replay_dead_letter is None:
+        # Products skipped as fresh are not reported as removed by stage 4
+        set_partial_snapshot(input_csv_dir, 'download', skipped['fresh'] and
+                             f"{skipped['fresh']} products downloaded less than {refresh_days} days ago were skipped")
+
+    if store is not None:
+        log.info("📦 Pack store: %s (%s)", store.format_stats(), store.pack_path)
+        store.close()
+    log.info("Processing complete! Results saved to: %s", output_csv)
+    log.info("🔌 HTTP: %s", http_session.format_stats(http_session.connection_stats()))
+    if HTTP_CACHE is not None:
+        log.info("♻️ Cache: %s, %d entries evicted", HTTP_CACHE.format_stats(), HTTP_CACHE.prune())
+    if session_dir is not None:
+        # An explicit session is not recorded in temp.txt
+        return output_folder
+    # Write output_dir_htmls to temp.txt
+    relative_output_folder = os.path.relpath(output_folder, script_dir)
+    temp_file = os.path.join(script_dir, "temp.txt")
+    with open(temp_file, "a") as f:
+        f.write(f"\noutput_dir_htmls={relative_output_folder}")
+
+    output_dir = get_output_dir()
+    if output_dir:
+        log.info("Output directory from temp.txt: %s", output_dir)
+    else:
+        log.info("No output directory found in temp.txt")
+    return output_folder
+
+def add_arguments(parser):
+    """Options of the download stage, shared by this script and puma_cli.py"""
+    parser.add_argument('--session-dir', default=None,
+                        help="session directory holding the stage 1 CSV (default: the one recorded in temp.txt)")
+    parser.add_argument('--rate', type=float, default=REQUESTS_PER_SECOND,
+                        help="starting requests per second per host, adapted on 429/503 and latency")
+    parser.add_argument('--pool-size', type=int, default=http_session.POOL_SIZE,
+                        help="keep-alive connections per host in each worker's session")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="skip the conditional-GET cache and download every page in full")
+    parser.add_argument('--cache-max-mb', type=int, default=MAX_CACHE_BYTES // 1024 ** 2,
+                        help="evict the oldest cache entries beyond this size")
+    parser.add_argument('--cache-max-age-days', type=float, default=MAX_CACHE_AGE_DAYS,
+                        help="evict cache entries not revalidated for this many days")
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS,
+                        help="download threads per host, unless its storefront sets a concurrency")
+    parser.add_argument('--window', type=int, default=None,
+                        help=f"rows per host in flight or waiting to be written "
+                             f"(default: workers * {WINDOW_PER_WORKER})")
+    parser.add_argument('--store', choices=['files', 'pack'], default='files',
+                        help="write one .html file per page, or append them to the compressed pack store")
+    parser.add_argument('--resume', action='store_true',
+                        help="skip downloads the session's checkpoint already records as finished")
+    parser.add_argument('--refresh-days', type=int, default=None,
+                        help="only download products that are new or were last downloaded at least this many days ago")
+    parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS,
+                        help="tries per page before it goes to the dead-letter file (timeouts, 429 and 5xx only)")
+    parser.add_argument('--replay-dead-letter', nargs='?', const='', default=None, metavar='PATH',
+                        help="only retry the downloads listed in a dead-letter file (default: the latest session's)")
+    storefronts.add_arguments(parser)
+
+def run(args):
+    """Apply the parsed command-line options and download; returns the htmls folder"""
+    global HTTP_CACHE
+    RATE_LIMITER.rate = args.rate
+    storefronts.configure(args.storefronts).apply_rates(RATE_LIMITER)
+    http_session.configure(pool_size=args.pool_size)
+    if args.no_cache:
+        HTTP_CACHE = None
+    else:
+        HTTP_CACHE.max_bytes = args.cache_max_mb * 1024 ** 2
+        HTTP_CACHE.max_age = args.cache_max_age_days * 86400
+    return main(max_workers=args.workers, window=args.window, use_pack=args.store == 'pack', resume=args.resume,
+                refresh_days=args.refresh_days, max_attempts=args.max_attempts,
+                replay_dead_letter=args.replay_dead_letter, session_dir=args.session_dir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download product pages listed by the latest stage 1 CSV.")
+    add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    finish_metrics = metrics.setup(args)
+    run(args)
+    finish_metrics()
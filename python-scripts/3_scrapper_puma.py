@@ -1,150 +1,318 @@
-import os
-import csv
-import json
-import re
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from bs4 import BeautifulSoup
-from datetime import datetime
-
-script_dir = os.path.dirname(os.path.abspath(__file__))
-
-with open(os.path.join(script_dir, 'temp.txt'), 'r') as f:
-    for line in f:
-        if line.startswith('output_dir='):
-            input_folder = line.split('=')[1].strip()
-            break
-input_folder = os.path.join(script_dir, input_folder)
-output_csv = os.path.join(input_folder, "obtained_data_htmls_puma.csv")
-
-def get_output_dir():
-    """Get output directory and output_dir_htmls from temp.txt in script directory"""
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    temp_file = os.path.join(script_dir, "temp.txt")
-    output_dir = None
-    output_dir_htmls = None
-    try:
-        with open(temp_file, "r") as f:
-            for line in f:
-                if line.startswith("output_dir="):
-                    output_dir = line.strip().split("output_dir=")[1].strip()
-                    print(f"📂 Output directory variable found: {output_dir}")
-                    print(f"📍 Directory path: {output_dir}")
-                    print(f"\nOutput directory: {output_dir}")
-                elif line.startswith("output_dir_htmls="):
-                    output_dir_htmls = line.strip().split("output_dir_htmls=")[1].strip()
-                    print(f"📂 Output directory htmls found: {output_dir_htmls}")
-        if output_dir is None:
-            print("⚠️ No 'output_dir' variable found in temp.txt")
-        if output_dir_htmls is None:
-            print("⚠️ No 'output_dir_htmls' variable found in temp.txt")
-        return output_dir_htmls if output_dir_htmls else output_dir
-    except FileNotFoundError:
-        print("⚠️ temp.txt not found in script directory")
-        return None
-
-def extract_data_from_html(html_path):
-    filename = os.path.basename(html_path)
-    try:
-        with open(html_path, 'r', encoding='utf-8') as f:
-            html_content = f.read()
-        soup = BeautifulSoup(html_content, 'html.parser')
-        scripts = soup.find_all('script', {'type': 'text/x-magento-init'})
-
-        # Product name
-        product_name = soup.title.string.strip() if soup.title else "Unknown Product"
-
-        # Magento data extraction
-        product_options_data = None
-        for script in scripts:
-            if script.string and '#product_addtocart_form' in script.string:
-                try:
-                    product_options_data = json.loads(script.string)
-                    break
-                except Exception:
-                    continue
-
-        if not product_options_data:
-            return []
-
-        try:
-            spConfig = product_options_data['#product_addtocart_form']['configurable']['spConfig']
-        except Exception:
-            return []
-
-        # Attribute identification
-        color_attr = next((a for a in spConfig['attributes'].values()
-                          if a['code'] in ['color', 'colour', 'tinte']), None)
-        size_attr = next((a for a in spConfig['attributes'].values()
-                         if a['code'] in ['size', 'talla']), None)
-        if not color_attr or not size_attr:
-            return []
-
-        # Color-size mapping
-        color_options = {
-            opt['label']: set(str(p) for p in opt['products'])
-            for opt in color_attr['options']
-        }
-
-        # Price and stock data
-        option_prices = spConfig.get('optionPrices', {})
-        currency = spConfig.get('currencySymbol', '$')
-        execution_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        rows = []
-        for color_label, color_skus in color_options.items():
-            for size_option in size_attr['options']:
-                size_sku_set = set(str(p) for p in size_option['all_products'])
-                common_skus = color_skus & size_sku_set
-                if not common_skus:
-                    continue
-                sku = common_skus.pop()
-                availability = "Out of Stock" if sku in size_option.get('out_of_stock', []) else "In Stock"
-                price_data = option_prices.get(sku, {})
-                original_price = price_data.get('oldPrice')
-                if isinstance(original_price, dict):
-                    original_price = original_price.get('amount', 'N/A')
-                if original_price is None:
-                    original_price = spConfig.get('basePrice', {}).get('amount', 'N/A')
-                discounted_price = price_data.get('finalPrice')
-                if isinstance(discounted_price, dict):
-                    discounted_price = discounted_price.get('amount', 'N/A')
-                if discounted_price is None:
-                    discounted_price = original_price
-                rows.append([
-                    filename,
-                    color_label,
-                    size_option['label'],
-                    sku,
-                    availability,
-                    f"{currency}{original_price}",
-                    f"{currency}{discounted_price}",
-                    product_name,
-                    execution_datetime
-                ])
-        print(f"✅ Processed: {filename}")
-        return rows
-    except Exception as e:
-        print(f"🚨 Error processing {filename}: {str(e)}")
-        return []
-
-header = [
-    "html_filename", "color", "size", "sku", "availability",
-    "original_price", "discounted_price", "product_name", "extraction_datetime"
-]
-
-with open(output_csv, 'w', newline='', encoding='utf-8') as f_out:
-    writer = csv.writer(f_out, delimiter=';')
-    writer.writerow(header)
-    output_dir_htmls = get_output_dir()
-    html_files = [
-        os.path.join(script_dir, output_dir_htmls, f)
-        for f in os.listdir(os.path.join(script_dir, output_dir_htmls))
-        if f.endswith('.html')
-    ]
-    with ThreadPoolExecutor(max_workers=os.cpu_count() * 2) as executor:
-        futures = {executor.submit(extract_data_from_html, file): file for file in html_files}
-        for future in as_completed(futures):
-            for row in future.result():
-                writer.writerow(row)
-
-print(f"✅ Extraction complete! Data saved to {output_csv}")
+import os
+import csv
+import argparse
+import logging
+import time
+from functools import partial
+from datetime import datetime
+from html_store import HTMLPackStore
+from magento_extract import extract_page_fields
+from scrape_manifest import ScrapeManifest, file_signature
+from parquet_sink import ParquetSink
+import storefronts
+import metrics
+from metrics import METRICS
+
+log = logging.getLogger('puma.scrape')
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+OUTPUT_FILENAME = "obtained_data_htmls_puma.csv"
+# Which pages were already scraped, for --incremental runs
+MANIFEST_FILENAME = "scrape_manifest.sqlite"
+# Parquet dataset shared by all runs (--parquet), partitioned by extraction date
+PARQUET_DIR = os.path.join(script_dir, 'downloaded_htmls', 'parquet')
+# Compressed page store written by 2_download_html_puma.py --store pack
+PACK_STORE_DIR = os.path.join(script_dir, 'downloaded_htmls', 'store')
+
+def get_input_folder():
+    """Session directory (output_dir) from temp.txt, as an absolute path"""
+    with open(os.path.join(script_dir, 'temp.txt'), 'r') as f:
+        for line in f:
+            if line.startswith('output_dir='):
+                input_folder = line.split('=')[1].strip()
+                break
+    return os.path.join(script_dir, input_folder)
+
+def get_output_dir():
+    """Get output directory and output_dir_htmls from temp.txt in script directory"""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    temp_file = os.path.join(script_dir, "temp.txt")
+    output_dir = None
+    output_dir_htmls = None
+    try:
+        with open(temp_file, "r") as f:
+            for line in f:
+                if line.startswith("output_dir="):
+                    output_dir = line.strip().split("output_dir=")[1].strip()
+                    log.info("📂 Output directory variable found: %s", output_dir)
+                elif line.startswith("output_dir_htmls="):
+                    output_dir_htmls = line.strip().split("output_dir_htmls=")[1].strip()
+                    log.info("📂 Output directory htmls found: %s", output_dir_htmls)
+        if output_dir is None:
+            log.warning("⚠️ No 'output_dir' variable found in temp.txt")
+        if output_dir_htmls is None:
+            log.warning("⚠️ No 'output_dir_htmls' variable found in temp.txt")
+        return output_dir_htmls if output_dir_htmls else output_dir
+    except FileNotFoundError:
+        log.warning("⚠️ temp.txt not found in script directory")
+        return None
+
+def extract_data_from_html(html_path):
+    filename = os.path.basename(html_path)
+    try:
+        with open(html_path, 'r', encoding='utf-8') as f:
+            html_content = f.read()
+    except Exception as e:
+        log.error("🚨 Error processing %s: %s", filename, e)
+        return []
+    return extract_data_from_content(filename, html_content)
+
+def extract_data_from_pack(store, key):
+    try:
+        html_content = store.get(key)
+    except Exception as e:
+        log.error("🚨 Error processing %s: %s", key, e)
+        return []
+    return extract_data_from_content(key, html_content)
+
+def extract_data_from_content(filename, html_content):
+    try:
+        # Product name and Magento data; scans for the spConfig block and only
+        # builds a full BeautifulSoup tree when that fails
+        product_name, product_options_data = extract_page_fields(html_content)
+
+        if not product_options_data:
+            return []
+
+        try:
+            spConfig = product_options_data['#product_addtocart_form']['configurable']['spConfig']
+        except Exception:
+            return []
+
+        # Attribute codes and currency of the page's storefront, named by its file's
+        # prefix; pages that do not name one accept any configured code
+        stores = storefronts.get_storefronts()
+        storefront, _ = stores.split_product_key(os.path.splitext(filename)[0])
+        color_codes = storefront.color_attributes if storefront else stores.color_attributes()
+        size_codes = storefront.size_attributes if storefront else stores.size_attributes()
+
+        # Attribute identification
+        color_attr = next((a for a in spConfig['attributes'].values()
+                          if a['code'] in color_codes), None)
+        size_attr = next((a for a in spConfig['attributes'].values()
+                         if a['code'] in size_codes), None)
+        if not color_attr or not size_attr:
+            return []
+
+        # Color-size mapping
+        color_options = {
+            opt['label']: set(str(p) for p in opt['products'])
+            for opt in color_attr['options']
+        }
+
+        # Price and stock data
+        option_prices = spConfig.get('optionPrices', {})
+        currency = spConfig.get('currencySymbol', (storefront or stores.primary).currency_symbol)
+        # The symbol alone ('$') does not tell regional storefronts apart
+        currency_code = (storefront or stores.primary).currency or ''
+        execution_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        rows = []
+        for color_label, color_skus in color_options.items():
+            for size_option in size_attr['options']:
+                size_sku_set = set(str(p) for p in size_option['all_products'])
+                common_skus = color_skus & size_sku_set
+                if not common_skus:
+                    continue
+                sku = common_skus.pop()
+                availability = "Out of Stock" if sku in size_option.get('out_of_stock', []) else "In Stock"
+                price_data = option_prices.get(sku, {})
+                original_price = price_data.get('oldPrice')
+                if isinstance(original_price, dict):
+                    original_price = original_price.get('amount', 'N/A')
+                if original_price is None:
+                    original_price = spConfig.get('basePrice', {}).get('amount', 'N/A')
+                discounted_price = price_data.get('finalPrice')
+                if isinstance(discounted_price, dict):
+                    discounted_price = discounted_price.get('amount', 'N/A')
+                if discounted_price is None:
+                    discounted_price = original_price
+                rows.append((
+                    filename,
+                    color_label,
+                    size_option['label'],
+                    sku,
+                    availability,
+                    f"{currency}{original_price}",
+                    f"{currency}{discounted_price}",
+                    product_name,
+                    execution_datetime,
+                    currency_code
+                ))
+        log.debug("✅ Processed: %s", filename)
+        return rows
+    except Exception as e:
+        log.error("🚨 Error processing %s: %s", filename, e)
+        return []
+
+header = [
+    "html_filename", "color", "size", "sku", "availability",
+    "original_price", "discounted_price", "product_name", "extraction_datetime", "currency_code"
+]
+# Part of every manifest signature: bump it when the row layout changes so
+# --incremental parses pages again instead of reusing rows of the old layout
+ROW_FORMAT = 'rows-v2'
+
+# Worker count and how many pages each process task carries (--workers / --chunksize)
+MAX_WORKERS = os.cpu_count() or 4
+CHUNK_SIZE = 32
+
+# Pack store opened once per worker by init_pack_worker
+_worker_store = None
+
+def init_pack_worker(store_dir, session):
+    global _worker_store
+    _worker_store = HTMLPackStore(store_dir, session, read_only=True)
+
+def init_worker(storefronts_path, store_dir=None, session=None):
+    """Process pool initializer: the parent's storefronts, and its pack store when scraping one"""
+    storefronts.configure(storefronts_path)
+    if store_dir is not None:
+        init_pack_worker(store_dir, session)
+
+def extract_data_from_pack_key(key):
+    return extract_data_from_pack(_worker_store, key)
+
+def run_timed(task_func, source):
+    """(rows, seconds) for one page; workers time themselves since their metrics stay in their process"""
+    started = time.perf_counter()
+    rows = task_func(source)
+    return rows, time.perf_counter() - started
+
+def main(use_pack=False, use_processes=True, max_workers=MAX_WORKERS, chunksize=CHUNK_SIZE, incremental=False,
+         parquet_dir=None, session_dir=None, html_dir=None):
+    """Scrape the pages of session_dir (default: temp.txt's) into its CSV; returns the CSV path.
+
+    html_dir defaults to the session's htmls folder, or output_dir_htmls in
+    temp.txt when no session was given.
+    """
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+    input_folder = os.path.abspath(session_dir) if session_dir is not None else get_input_folder()
+    output_csv = os.path.join(input_folder, OUTPUT_FILENAME)
+    session = os.path.basename(os.path.normpath(input_folder))
+    if use_pack:
+        # Pages of this session straight from the pack, no .html files on disk
+        init_pack_worker(PACK_STORE_DIR, session)
+        # The content hash is the signature of a pack entry
+        sources = _worker_store.entries()
+        task_func = extract_data_from_pack_key
+    else:
+        if html_dir is not None:
+            html_dir = os.path.abspath(html_dir)
+        elif session_dir is not None:
+            html_dir = os.path.join(input_folder, 'htmls')
+        else:
+            html_dir = os.path.join(script_dir, get_output_dir())
+        sources = [
+            (entry.path, file_signature(entry.stat()))
+            for entry in os.scandir(html_dir)
+            if entry.name.endswith('.html')
+        ]
+        task_func = extract_data_from_html
+    manifest = ScrapeManifest(os.path.join(input_folder, MANIFEST_FILENAME)) if incremental else None
+    if manifest is not None:
+        sources = [(source, f"{ROW_FORMAT}:{signature}") for source, signature in sources]
+        removed = manifest.forget_missing({source for source, _ in sources})
+        tasks = [source for source, signature in sources if not manifest.is_current(source, signature)]
+        log.info("🗂️ Manifest: %d of %d pages new or changed, %d removed", len(tasks), len(sources), removed)
+    else:
+        tasks = [source for source, _ in sources]
+    if use_processes:
+        # Parsing is CPU bound; processes sidestep the GIL and each task carries
+        # a chunk of pages so dispatch overhead stays small
+        initargs = (storefronts.config_path(),) + ((PACK_STORE_DIR, session) if use_pack else ())
+        executor = ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker, initargs=initargs)
+    else:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    # Optional typed columnar copy of the rows, partitioned by extraction date
+    sink = ParquetSink(parquet_dir) if parquet_dir else None
+    with open(output_csv, 'w', newline='', encoding='utf-8') as f_out:
+        writer = csv.writer(f_out, delimiter=';')
+        writer.writerow(header)
+
+        def write_rows(rows, parsed_now=True):
+            writer.writerows(rows)
+            METRICS.inc('rows_total', len(rows), stage='scrape')
+            # Rows kept from the manifest went to Parquet on the run that parsed them
+            if sink is not None and parsed_now:
+                sink.add_rows(rows)
+
+        def parsed(results):
+            for rows, seconds in results:
+                METRICS.observe('parse_seconds', seconds, stage='scrape')
+                METRICS.inc('pages_total', stage='scrape')
+                yield rows
+
+        with executor:
+            # Workers hand back row tuples, this process is the only writer
+            results = parsed(executor.map(partial(run_timed, task_func), tasks, chunksize=chunksize))
+            if manifest is None:
+                for rows in results:
+                    write_rows(rows)
+            else:
+                # Unchanged pages keep the rows stored in the manifest, fresh
+                # results are merged in at their place in the listing
+                for source, signature in sources:
+                    if manifest.is_current(source, signature):
+                        write_rows(manifest.stored_rows(source), parsed_now=False)
+                    else:
+                        rows = next(results)
+                        manifest.record(source, signature, rows)
+                        write_rows(rows)
+    if manifest is not None:
+        manifest.close()
+    if sink is not None:
+        log.info("🧱 Parquet: %d rows written under %s", sink.close(), parquet_dir)
+    if _worker_store is not None:
+        _worker_store.close()
+
+    log.info("✅ Extraction complete! Data saved to %s", output_csv)
+    return output_csv
+
+def add_arguments(parser):
+    """Options of the scrape stage, shared by this script and puma_cli.py"""
+    parser.add_argument('--session-dir', default=None,
+                        help="session directory to scrape and write the CSV to (default: the one recorded in temp.txt)")
+    parser.add_argument('--html-dir', default=None,
+                        help="directory of the .html files (default: the session's htmls folder)")
+    parser.add_argument('--store', choices=['files', 'pack'], default='files',
+                        help="read the .html files of the session, or its pages in the compressed pack store")
+    parser.add_argument('--executor', choices=['processes', 'threads'], default='processes',
+                        help="parse pages in worker processes (default) or threads")
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS,
+                        help="worker processes or threads")
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE,
+                        help="pages per task sent to a worker process")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only parse pages that are new or changed since the last run, reuse stored rows for the rest")
+    parser.add_argument('--parquet', nargs='?', const=PARQUET_DIR, default=None, metavar='DIR',
+                        help=f"also write typed Parquet, partitioned by extraction date (default dir: {PARQUET_DIR})")
+    storefronts.add_arguments(parser)
+
+def run(args):
+    """Scrape with the parsed command-line options; returns the CSV path"""
+    storefronts.configure(args.storefronts)
+    return main(use_pack=args.store == 'pack', use_processes=args.executor == 'processes',
+                max_workers=args.workers, chunksize=args.chunksize, incremental=args.incremental,
+                parquet_dir=args.parquet, session_dir=args.session_dir, html_dir=args.html_dir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract color/size/price rows from downloaded product pages.")
+    add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    finish_metrics = metrics.setup(args)
+    run(args)
+    finish_metrics()
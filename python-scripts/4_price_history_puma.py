@@ -0,0 +1,273 @@
+import argparse
+import logging
+import os
+from parquet_sink import PRICE_RE, row_schema
+from checkpoint import partial_snapshot
+import storefronts
+import metrics
+from metrics import METRICS
+
+log = logging.getLogger('puma.history')
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Written by this stage only, one extraction_date= partition per day; stage 3's
+# --parquet dataset is a separate copy of the scraped rows
+HISTORY_DIR = os.path.join(script_dir, 'downloaded_htmls', 'price_history')
+SCRAPE_FILENAME = "obtained_data_htmls_puma.csv"
+OUTPUT_FILENAME = "price_changes_puma.csv"
+HISTORY_COLUMNS = ['sku', 'product_name', 'color', 'size', 'availability', 'currency',
+                   'original_price', 'discounted_price', 'extraction_datetime', 'html_filename', 'partial',
+                   'currency_code']
+# Stage 2 names the pages of every storefront but the primary one <storefront>-<product ID>.html
+STOREFRONT_FILE_RE = r'^([a-z0-9_]+)-\d+\.html$'
+
+def get_input_folder():
+    """Session directory (output_dir) from temp.txt, as an absolute path"""
+    with open(os.path.join(script_dir, 'temp.txt'), 'r') as f:
+        for line in f:
+            if line.startswith('output_dir='):
+                input_folder = line.split('=')[1].strip()
+                break
+    return os.path.join(script_dir, input_folder)
+
+def history_schema():
+    """Stage 3's row schema plus partial: the run only re-fetched some products (see checkpoint.partial_snapshot)"""
+    import pyarrow as pa
+
+    return row_schema().append(pa.field('partial', pa.bool_()))
+
+def ingest_csv(csv_path, store_dir=HISTORY_DIR):
+    """Add one run's scraped CSV to the history dataset; returns the rows written.
+
+    Files are named after the run (its session directory), so ingesting the
+    same run again replaces its files instead of duplicating the rows.
+    """
+    # pandas and pyarrow take longer to import than most runs take to report
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    session_dir = os.path.dirname(os.path.abspath(csv_path))
+    run_name = os.path.basename(session_dir)
+    df = pd.read_csv(csv_path, sep=';', dtype=str, keep_default_na=False)
+    if df.empty:
+        return 0
+    partial = partial_snapshot(session_dir)
+    for stage, reason in partial.items():
+        log.info("🧩 Partial snapshot (%s): %s", stage, reason)
+    df['partial'] = bool(partial)
+    original = df['original_price'].str.extract(PRICE_RE.pattern)
+    discounted = df['discounted_price'].str.extract(PRICE_RE.pattern)
+    currency = original[0].where(original[0].fillna('') != '', discounted[0])
+    # mask, not replace('', None), which pad-fills from the previous row on pandas < 2
+    df['currency'] = currency.mask(currency == '')
+    df['original_price'] = pd.to_numeric(original[1], errors='coerce')
+    df['discounted_price'] = pd.to_numeric(discounted[1], errors='coerce')
+    # Scraped CSVs from before the currency_code column get their storefront's
+    codes = storefront_currency_codes(storefront_names(df['html_filename']))
+    df['currency_code'] = df['currency_code'].mask(df['currency_code'] == '') if 'currency_code' in df else None
+    df['currency_code'] = df['currency_code'].fillna(codes)
+    df['extraction_datetime'] = pd.to_datetime(df['extraction_datetime'], format="%Y-%m-%d %H:%M:%S")
+    schema = history_schema()
+    for extraction_date, part in df.groupby(df['extraction_datetime'].dt.strftime('%Y-%m-%d')):
+        table = pa.Table.from_pandas(part[schema.names], preserve_index=False).cast(schema)
+        partition_dir = os.path.join(store_dir, f"extraction_date={extraction_date}")
+        os.makedirs(partition_dir, exist_ok=True)
+        pq.write_table(table, os.path.join(partition_dir, f"part-run-{run_name}.parquet"), compression='zstd')
+    return len(df)
+
+def snapshot_dates(store_dir=HISTORY_DIR):
+    if not os.path.isdir(store_dir):
+        return []
+    return sorted(name.split('=', 1)[1] for name in os.listdir(store_dir) if name.startswith('extraction_date='))
+
+def storefront_names(filenames):
+    """Storefront of each row, from the page file name it was scraped from"""
+    stores = storefronts.get_storefronts()
+    prefix = filenames.str.extract(STOREFRONT_FILE_RE, expand=False)
+    return prefix.where(prefix.isin(list(stores.by_name)), stores.primary.name)
+
+def storefront_currency_codes(names):
+    """ISO currency of each row's storefront (see storefront_names)"""
+    return names.map({storefront.name: storefront.currency for storefront in storefronts.get_storefronts()})
+
+def load_history(store_dir=HISTORY_DIR, dates=None):
+    """SKU observations of the given extraction dates (all when None) as a DataFrame, with their storefront"""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    partition = pa.field('extraction_date', pa.string())
+    partitioning = ds.partitioning(pa.schema([partition]), flavor='hive')
+    # Files from before the partial column read it as null, i.e. a full snapshot
+    dataset = ds.dataset(store_dir, format='parquet', partitioning=partitioning,
+                         schema=history_schema().append(partition))
+    where = ds.field('extraction_date').isin(dates) if dates is not None else None
+    history = dataset.to_table(columns=HISTORY_COLUMNS, filter=where).to_pandas()
+    history['partial'] = history['partial'].fillna(False).astype(bool)
+    history['storefront'] = storefront_names(history['html_filename'])
+    history['currency_code'] = history['currency_code'].astype(object).fillna(
+        storefront_currency_codes(history['storefront']))
+    return history
+
+def compute_changes(history):
+    """Per-SKU deltas between consecutive daily snapshots, keeping only the rows that changed.
+
+    A SKU is identified by its storefront and SKU code, since regional
+    storefronts can share SKU codes. The latest observation of a SKU on each
+    day is its snapshot for that day. A SKU is 'new' on a day when it was
+    absent the snapshot before (the first snapshot has no new SKUs),
+    'removed' on the first snapshot it is missing from, and otherwise
+    reported when its discounted price or its availability differs from the
+    previous snapshot. A partial snapshot (a run that only re-fetched some
+    products) carries forward the SKUs of every product it did not fetch.
+    Everything is computed on sorted NumPy arrays, with no per-SKU Python
+    loop.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if history.empty:
+        return pd.DataFrame()
+    snapshot = history['extraction_datetime'].dt.normalize().to_numpy()
+    snapshots = np.unique(snapshot)
+    day = np.searchsorted(snapshots, snapshot)
+    sku_code = history.groupby(['storefront', 'sku'], sort=False).ngroup().to_numpy()
+    product_code, _ = pd.factorize(history['html_filename'])
+    partial_day = np.zeros(len(snapshots), dtype=bool)
+    partial_day[day[history['partial'].to_numpy(dtype=bool)]] = True
+    # Order by SKU, then day, then time, and keep each SKU's last row per day
+    order = np.lexsort((history['extraction_datetime'].to_numpy(), day, sku_code))
+    sku_code, day = sku_code[order], day[order]
+    last_of_day = np.r_[(sku_code[1:] != sku_code[:-1]) | (day[1:] != day[:-1]), True]
+    rows = history.iloc[order[last_of_day]].reset_index(drop=True)
+    sku_code, day, product_code = sku_code[last_of_day], day[last_of_day], product_code[order[last_of_day]]
+
+    # Products a partial snapshot did not fetch keep their previous day's SKUs,
+    # so they are neither removed that day nor new the day after
+    carried_any = False
+    for partial in np.flatnonzero(partial_day[1:]) + 1:
+        carried = (day == partial - 1) & ~np.isin(product_code, product_code[day == partial])
+        if carried.any():
+            carried_any = True
+            rows = pd.concat([rows, rows[carried]], ignore_index=True)
+            sku_code = np.r_[sku_code, sku_code[carried]]
+            product_code = np.r_[product_code, product_code[carried]]
+            day = np.r_[day, np.full(carried.sum(), partial)]
+    if carried_any:
+        order = np.lexsort((day, sku_code))
+        rows = rows.iloc[order].reset_index(drop=True)
+        sku_code, day, product_code = sku_code[order], day[order], product_code[order]
+
+    same_sku_before = np.r_[False, sku_code[1:] == sku_code[:-1]]
+    has_previous = same_sku_before & (np.r_[-1, day[:-1]] == day - 1)
+    same_sku_after = np.r_[sku_code[:-1] == sku_code[1:], False]
+    has_next = same_sku_after & (np.r_[day[1:], -1] == day + 1)
+
+    price = rows['discounted_price'].to_numpy(dtype=float)
+    original = rows['original_price'].to_numpy(dtype=float)
+    previous_price = np.r_[np.nan, price[:-1]]
+    availability = rows['availability'].astype('category')
+    availability_code = availability.cat.codes.to_numpy()
+    previous_code = np.r_[-1, availability_code[:-1]]
+
+    is_new = ~has_previous & (day > 0)
+    price_changed = has_previous & ~np.isclose(price, previous_price, equal_nan=True)
+    stock_flipped = has_previous & (availability_code != previous_code)
+    is_removed = ~has_next & (day < len(snapshots) - 1)
+
+    # Output columns are only built for the (few) rows that changed
+    def select(mask):
+        selected = rows.loc[mask, ['storefront'] + HISTORY_COLUMNS[:6] + ['currency_code']].reset_index(drop=True)
+        selected['snapshot'] = snapshots[day[mask]]
+        return selected
+
+    changed_mask = is_new | price_changed | stock_flipped
+    changed = select(changed_mask)
+    labels = np.array(['', 'new', 'price', 'new+price', 'stock', 'new+stock', 'price+stock', 'new+price+stock'])
+    changed['change'] = labels[(is_new[changed_mask] * 1 + price_changed[changed_mask] * 2
+                                + stock_flipped[changed_mask] * 4)]
+    previous_categories = np.append(availability.cat.categories.to_numpy(dtype=object), None)
+    changed['previous_availability'] = previous_categories[np.where(has_previous, previous_code, -1)[changed_mask]]
+    changed['previous_price'] = np.where(has_previous, previous_price, np.nan)[changed_mask]
+    changed['price'] = price[changed_mask]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        price_delta = np.where(price_changed, price - previous_price, np.nan)[changed_mask]
+        changed['price_delta'] = price_delta
+        changed['price_delta_pct'] = np.round(price_delta / changed['previous_price'].to_numpy() * 100, 1)
+        changed['original_price'] = original[changed_mask]
+        changed['discount_pct'] = np.round((original - price) / original * 100, 1)[changed_mask]
+
+    # A removed SKU is reported on the snapshot after its last one, with its last known values as previous
+    removed = select(is_removed)
+    removed['snapshot'] = snapshots[day[is_removed] + 1]
+    removed['change'] = 'removed'
+    removed['previous_availability'] = removed['availability'].astype(object)
+    removed['availability'] = None
+    removed['previous_price'] = price[is_removed]
+    for column in ('price', 'price_delta', 'price_delta_pct', 'original_price', 'discount_pct'):
+        removed[column] = np.nan
+
+    result = pd.concat([changed, removed], ignore_index=True)
+    return result.sort_values(['snapshot', 'storefront', 'sku'], kind='stable').reset_index(drop=True)
+
+def main(ingest=(), store_dir=HISTORY_DIR, all_history=False, output_csv=None):
+    for csv_path in ingest:
+        log.info("📥 Ingested %d rows from %s", ingest_csv(csv_path, store_dir), csv_path)
+    dates = snapshot_dates(store_dir)
+    if not dates:
+        log.warning("⚠️ No snapshots in %s", store_dir)
+        return None
+    # The latest snapshot's changes only need the snapshot before it
+    with METRICS.timer('parse_seconds', stage='history'):
+        history = load_history(store_dir, None if all_history else dates[-2:])
+        changes = compute_changes(history)
+    METRICS.inc('rows_total', len(history), stage='history')
+    if not all_history and not changes.empty:
+        changes = changes[changes['snapshot'] == changes['snapshot'].max()]
+    log.info("📈 %d SKU observations over %d snapshots, %d changed rows",
+             len(history), len(dates) if all_history else min(len(dates), 2), len(changes))
+    if not changes.empty:
+        for change, count in changes['change'].value_counts().items():
+            log.info("   %s: %d", change, count)
+    if output_csv:
+        changes.to_csv(output_csv, sep=';', index=False, date_format='%Y-%m-%d')
+        log.info("✅ Changes saved to %s", output_csv)
+    return changes
+
+def add_arguments(parser):
+    """Options of the price history stage, shared by this script and puma_cli.py"""
+    parser.add_argument('--session-dir', default=None,
+                        help="session whose scraped CSV is ingested and where the report goes "
+                             "(default: the one recorded in temp.txt)")
+    parser.add_argument('--csv', nargs='*', default=None, metavar='PATH',
+                        help=f"scraped CSVs to add to the history (default: the session's {SCRAPE_FILENAME})")
+    parser.add_argument('--no-ingest', action='store_true',
+                        help="only report on what the history already holds")
+    parser.add_argument('--store', default=HISTORY_DIR, help="history dataset directory")
+    parser.add_argument('--all-history', action='store_true',
+                        help="report changes between every pair of consecutive snapshots, not only the latest")
+    parser.add_argument('--output', default=None,
+                        help=f"changes CSV (default: {OUTPUT_FILENAME} in the session directory)")
+    storefronts.add_arguments(parser)
+
+def run(args):
+    """Ingest and report with the parsed command-line options; returns the changes"""
+    storefronts.configure(args.storefronts)
+    session_dir = None
+    if args.csv is None or args.output is None:
+        session_dir = os.path.abspath(args.session_dir) if args.session_dir else get_input_folder()
+    if args.no_ingest:
+        ingest = []
+    else:
+        ingest = args.csv if args.csv is not None else [os.path.join(session_dir, SCRAPE_FILENAME)]
+    return main(ingest, args.store, args.all_history, args.output or os.path.join(session_dir, OUTPUT_FILENAME))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Track SKU prices and stock across runs and report what changed.")
+    add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    finish_metrics = metrics.setup(args)
+    run(args)
+    finish_metrics()
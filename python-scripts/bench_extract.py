@@ -0,0 +1,79 @@
+import argparse
+import os
+import time
+# magento_extract loads bs4 lazily; import it here so the soup timing leaves the import out
+import bs4
+from magento_extract import fast_product_options, fast_title, soup_page_fields, extract_page_fields
+from html_store import HTMLPackStore
+
+
+def load_corpus(html_dir=None, store_dir=None, session=None, limit=None):
+    """Saved pages as (name, html): .html files of a directory, or one session of the pack store"""
+    pages = []
+    if store_dir:
+        store = HTMLPackStore(store_dir, session, read_only=True)
+        for key, html_content in store.iter_pages():
+            pages.append((key, html_content))
+            if limit and len(pages) >= limit:
+                break
+        store.close()
+        return pages
+    for name in sorted(os.listdir(html_dir)):
+        if not name.endswith('.html'):
+            continue
+        with open(os.path.join(html_dir, name), 'r', encoding='utf-8') as f:
+            pages.append((name, f.read()))
+        if limit and len(pages) >= limit:
+            break
+    return pages
+
+
+def run_path(pages, extract, repeat):
+    results = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        results = [extract(html_content) for _, html_content in pages]
+    elapsed = time.perf_counter() - started
+    return results, len(pages) * repeat / elapsed if elapsed else float('inf')
+
+
+def fast_only(html_content):
+    return fast_title(html_content), fast_product_options(html_content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the fast spConfig scan against the full BeautifulSoup parse.")
+    parser.add_argument('html_dir', nargs='?', help="directory with saved product .html files")
+    parser.add_argument('--store', help="pack store directory to read pages from instead")
+    parser.add_argument('--session', help="session (run directory name) inside the pack store")
+    parser.add_argument('--limit', type=int, help="only use the first N pages")
+    parser.add_argument('--repeat', type=int, default=3, help="passes over the corpus per path")
+    args = parser.parse_args()
+    if not args.html_dir and not (args.store and args.session):
+        parser.error("give an html directory, or --store and --session")
+
+    pages = load_corpus(args.html_dir, args.store, args.session, args.limit)
+    if not pages:
+        print("⚠️ No pages found")
+        return
+    size_mb = sum(len(html_content) for _, html_content in pages) / 1024 ** 2
+    print(f"📄 Corpus: {len(pages)} pages, {size_mb:.1f} MB")
+
+    soup_results, soup_rate = run_path(pages, soup_page_fields, args.repeat)
+    fast_results, fast_rate = run_path(pages, fast_only, args.repeat)
+    _, combined_rate = run_path(pages, extract_page_fields, args.repeat)
+
+    fast_hits = sum(1 for _, data in fast_results if data is not None)
+    mismatches = [name for (name, _), fast, soup in zip(pages, fast_results, soup_results)
+                  if fast[1] is not None and fast != soup]
+    print(f"🐢 BeautifulSoup (html.parser): {soup_rate:,.1f} pages/sec")
+    print(f"⚡ Fast scan only:              {fast_rate:,.1f} pages/sec ({fast_hits}/{len(pages)} pages resolved)")
+    print(f"🔀 Fast scan with fallback:     {combined_rate:,.1f} pages/sec ({combined_rate / soup_rate:.1f}x)")
+    if mismatches:
+        print(f"⚠️ {len(mismatches)} pages differ between paths, e.g. {mismatches[:5]}")
+    else:
+        print("✅ Fast scan matches the full parse on every page it resolved")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import argparse
+import csv
+import importlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+import http_session
+import storefronts
+from mock_storefront import MockStorefront
+
+try:
+    import resource
+except ImportError:  # Windows: CPU time of worker processes and peak RSS are not available
+    resource = None
+
+crawl_stage = importlib.import_module('1_obtain_urls_puma')
+download_stage = importlib.import_module('2_download_html_puma')
+scrape_stage = importlib.import_module('3_scrapper_puma')
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_FILE = os.path.join(SCRIPT_DIR, 'downloaded_htmls', 'bench', 'bench_results.jsonl')
+# Seconds between RSS samples while a stage runs
+RSS_SAMPLE_INTERVAL = 0.05
+
+
+def current_rss():
+    """Resident set size of this process in bytes, None where /proc is not available"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def children_usage():
+    """(CPU seconds, peak RSS in MB of the largest child) over reaped worker processes"""
+    if resource is None:
+        return 0.0, 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024
+
+
+class StageMeter:
+    """Wall time, CPU time (this process and its finished workers) and peak RSS of one stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.peak_rss = 0
+        self.stopped = threading.Event()
+
+    def _sample(self):
+        while True:
+            rss = current_rss()
+            if rss is not None:
+                self.peak_rss = max(self.peak_rss, rss)
+            if self.stopped.wait(RSS_SAMPLE_INTERVAL):
+                return
+
+    def __enter__(self):
+        self.sampler = threading.Thread(target=self._sample, daemon=True)
+        self.sampler.start()
+        self.children_cpu, _ = children_usage()
+        self.cpu = time.process_time()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self.started
+        self.cpu = time.process_time() - self.cpu
+        children_cpu, self.child_peak_rss_mb = children_usage()
+        self.children_cpu = children_cpu - self.children_cpu
+        self.stopped.set()
+        self.sampler.join()
+
+    def result(self, pages, rows):
+        return {
+            'stage': self.name,
+            'pages': pages,
+            'rows': rows,
+            'seconds': round(self.wall, 3),
+            'pages_per_sec': round(pages / self.wall, 2) if self.wall else None,
+            'rows_per_sec': round(rows / self.wall, 2) if self.wall else None,
+            'cpu_seconds': round(self.cpu, 3),
+            'worker_cpu_seconds': round(self.children_cpu, 3),
+            'peak_rss_mb': round(self.peak_rss / 1024 ** 2, 1) if self.peak_rss else None,
+            'worker_peak_rss_mb': round(self.child_peak_rss_mb, 1),
+        }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmark(storefront, work_dir, download_workers, scrape_workers, chunksize):
+    """Crawl, download and scrape the storefront stage after stage; returns one result per stage"""
+    input_csv = os.path.join(work_dir, 'input_urls.csv')
+    with open(input_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['category_1', 'url'])
+        for url in storefront.category_urls():
+            writer.writerow(['bench', url])
+    crawl_csv = os.path.join(work_dir, 'obtained_urls.csv')
+    html_dir = os.path.join(work_dir, 'htmls')
+    os.makedirs(html_dir)
+    results = []
+
+    before = storefront.stats['category']
+    with StageMeter('crawl') as meter:
+        crawl_stage.process_urls(input_csv, crawl_csv)
+    with open(crawl_csv, 'r', encoding='utf-8') as f:
+        crawled = list(csv.DictReader(f, delimiter=';'))
+    results.append(meter.result(storefront.stats['category'] - before, len(crawled)))
+
+    tasks = [(row['crawled_url'], row['url'], html_dir) for row in crawled
+             if row['first_encounter'] == 'first encounter']
+    with StageMeter('download') as meter:
+        with ThreadPoolExecutor(max_workers=download_workers) as executor:
+            downloaded = [filepath for _, filepath, _, _ in executor.map(download_stage.download_html_task, tasks)
+                          if filepath]
+    results.append(meter.result(len(downloaded), len(downloaded)))
+
+    with StageMeter('scrape') as meter:
+        with ProcessPoolExecutor(max_workers=scrape_workers, initializer=scrape_stage.init_worker,
+                                 initargs=(storefronts.config_path(),)) as executor:
+            rows = sum(len(page_rows) for page_rows in
+                       executor.map(scrape_stage.extract_data_from_html, downloaded, chunksize=chunksize))
+    results.append(meter.result(len(downloaded), rows))
+    return results
+
+
+def print_results(results):
+    print(f"{'stage':<9}{'pages':>8}{'rows':>9}{'sec':>9}{'pages/s':>10}{'rows/s':>11}"
+          f"{'cpu s':>8}{'wrk cpu':>9}{'rss MB':>8}{'wrk MB':>8}")
+    for r in results:
+        print(f"{r['stage']:<9}{r['pages']:>8}{r['rows']:>9}{r['seconds']:>9.2f}{r['pages_per_sec'] or 0:>10.1f}"
+              f"{r['rows_per_sec'] or 0:>11.1f}{r['cpu_seconds']:>8.2f}{r['worker_cpu_seconds']:>9.2f}"
+              f"{r['peak_rss_mb'] or 0:>8.1f}{r['worker_peak_rss_mb']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark crawl, download and scrape against a local mock storefront.")
+    parser.add_argument('--categories', type=int, default=4)
+    parser.add_argument('--products', type=int, default=240, help="products per category")
+    parser.add_argument('--page-size', type=int, default=24, help="products per listing page")
+    parser.add_argument('--latency', type=float, default=0.01, help="seconds the server adds to every response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument('--page-kb', type=int, default=250, help="approximate product page size")
+    parser.add_argument('--rate', type=float, default=1000.0, help="starting requests per second per host")
+    parser.add_argument('--download-workers', type=int, default=download_stage.MAX_WORKERS)
+    parser.add_argument('--scrape-workers', type=int, default=scrape_stage.MAX_WORKERS)
+    parser.add_argument('--chunksize', type=int, default=scrape_stage.CHUNK_SIZE)
+    parser.add_argument('--output', default=RESULTS_FILE, help="JSON lines file the run is appended to")
+    parser.add_argument('--keep', action='store_true', help="keep the downloaded pages and CSVs")
+    parser.add_argument('--log-level', default='WARNING', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'))
+    args = parser.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log_level))
+
+    # Measure the network path as is: no conditional-GET cache, no politeness cap
+    crawl_stage.HTTP_CACHE = None
+    download_stage.HTTP_CACHE = None
+    crawl_stage.RATE_LIMITER.rate = args.rate
+    download_stage.RATE_LIMITER.rate = args.rate
+    http_session.configure(pool_size=max(args.download_workers, http_session.POOL_SIZE))
+
+    work_dir = tempfile.mkdtemp(prefix='puma_bench_')
+    storefront = MockStorefront(args.categories, args.products, args.page_size, latency=args.latency,
+                                error_rate=args.error_rate, page_bytes=args.page_kb * 1000)
+    try:
+        # The mock is the only (so the primary) storefront of the run
+        storefronts_file = os.path.join(work_dir, 'storefronts.json')
+        with open(storefronts_file, 'w', encoding='utf-8') as f:
+            json.dump([{'name': 'mock', 'host': storefront.host}], f)
+        storefronts.configure(storefronts_file)
+        with storefront:
+            results = run_benchmark(storefront, work_dir, args.download_workers, args.scrape_workers,
+                                    args.chunksize)
+    finally:
+        if args.keep:
+            print(f"📁 Kept {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_results(results)
+    record = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'params': {key: value for key, value in vars(args).items() if key not in ('output', 'keep', 'log_level')},
+        'server': dict(storefront.stats),
+        'stages': results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + '\n')
+    print(f"📝 Appended to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
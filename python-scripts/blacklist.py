@@ -0,0 +1,153 @@
+import fnmatch
+import logging
+import re
+from collections import Counter
+
+log = logging.getLogger(__name__)
+
+# Rule prefixes in the blacklist file; lines without one are exact URLs
+PREFIX_RULE = 'prefix:'
+GLOB_RULE = 'glob:'
+REGEX_RULE = 're:'
+# Key marking the end of a prefix rule in the trie
+END = ''
+# URL words used to index glob rules
+WORD_RE = re.compile(r'\w+')
+GLOB_WILDCARDS = '*?[]'
+
+
+def glob_keywords(glob):
+    """Whole words every URL matching glob must contain.
+
+    A word qualifies when it is delimited on both sides by literal
+    punctuation or the ends of the pattern, so it is also a whole word of
+    every matching URL.
+    """
+    if '[' in glob:
+        return []
+    words = []
+    for match in WORD_RE.finditer(glob):
+        start, end = match.span()
+        if start > 0 and glob[start - 1] in GLOB_WILDCARDS:
+            continue
+        if end < len(glob) and glob[end] in GLOB_WILDCARDS:
+            continue
+        words.append(match.group())
+    return words
+
+
+class Blacklist:
+    """URL blacklist with exact, prefix and pattern rules.
+
+    Exact URLs live in a set and prefixes in a character trie walked once per
+    lookup. Glob rules are indexed by a word every matching URL must contain,
+    so only the few globs sharing a word with the URL are tried; regex rules
+    and globs without such a word are compiled into a single alternation.
+    Lookup cost therefore stays flat as rules are added. `url in blacklist`
+    works as with the plain set it replaces; hits are counted per rule kind
+    instead of being logged.
+    """
+
+    def __init__(self, normalize=None):
+        self.normalize = normalize
+        self.exact = set()
+        self.trie = {}
+        self.prefixes = 0
+        self.globs = {}
+        self.globs_count = 0
+        self.patterns = []
+        self.pattern = None
+        self.counts = Counter()
+
+    def add(self, rule):
+        """Add one rule: 'prefix:<url prefix>', 'glob:<pattern>', 're:<regex>' or an exact URL"""
+        rule = rule.strip()
+        if rule.startswith(PREFIX_RULE):
+            node = self.trie
+            for char in rule[len(PREFIX_RULE):].strip():
+                node = node.setdefault(char, {})
+            if END not in node:
+                node[END] = True
+                self.prefixes += 1
+        elif rule.startswith(GLOB_RULE):
+            glob = rule[len(GLOB_RULE):].strip()
+            regex = fnmatch.translate(glob)
+            words = glob_keywords(glob)
+            if not words:
+                self.patterns.append(r'\A' + regex)
+                self.pattern = None
+            else:
+                # File the glob under its least used word, so words common to
+                # many rules (host, 'html'...) do not collect them all
+                keyword = min(words, key=lambda word: (len(self.globs.get(word, ())), -len(word)))
+                self.globs.setdefault(keyword, []).append(re.compile(regex))
+                self.globs_count += 1
+        elif rule.startswith(REGEX_RULE):
+            regex = rule[len(REGEX_RULE):].strip()
+            re.compile(regex)  # Raise on a bad rule here rather than on first lookup
+            self.patterns.append(f'(?:{regex})')
+            self.pattern = None
+        elif rule:
+            self.exact.add(self.normalize(rule) if self.normalize else rule)
+
+    @classmethod
+    def load(cls, path, normalize=None):
+        """Read one rule per line; blank lines, '#' comments and the CSV header are skipped"""
+        blacklist = cls(normalize)
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            for line_number, line in enumerate(f, 1):
+                rule = line.strip()
+                if not rule or rule.startswith('#') or (line_number == 1 and rule == 'blacklist'):
+                    continue
+                try:
+                    blacklist.add(rule)
+                except re.error as e:
+                    log.error("Ignoring invalid blacklist rule on line %d: %s (%s)", line_number, rule, e)
+        return blacklist
+
+    def _has_prefix(self, url):
+        node = self.trie
+        for char in url:
+            node = node.get(char)
+            if node is None:
+                return False
+            if END in node:
+                return True
+        return False
+
+    def match(self, url):
+        """Kind of the rule url hits ('exact', 'prefix' or 'pattern'), None if it is allowed"""
+        if url in self.exact:
+            return 'exact'
+        if self.trie and self._has_prefix(url):
+            return 'prefix'
+        if self.globs:
+            for word in set(WORD_RE.findall(url)):
+                for glob in self.globs.get(word, ()):
+                    if glob.match(url):
+                        return 'pattern'
+        if self.patterns:
+            if self.pattern is None:
+                self.pattern = re.compile('|'.join(self.patterns))
+            if self.pattern.search(url):
+                return 'pattern'
+        return None
+
+    def __contains__(self, url):
+        kind = self.match(url)
+        self.counts['checked'] += 1
+        if kind is not None:
+            self.counts[kind] += 1
+        return kind is not None
+
+    def __len__(self):
+        return len(self.exact) + self.prefixes + self.globs_count + len(self.patterns)
+
+    def describe(self):
+        return (f"{len(self.exact)} exact, {self.prefixes} prefix, "
+                f"{self.globs_count + len(self.patterns)} pattern rules")
+
+    def format_stats(self):
+        blocked = self.counts['exact'] + self.counts['prefix'] + self.counts['pattern']
+        return (f"{blocked} of {self.counts['checked']} URLs blacklisted "
+                f"({self.counts['exact']} exact, {self.counts['prefix']} prefix, {self.counts['pattern']} pattern)")
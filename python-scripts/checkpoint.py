@@ -0,0 +1,129 @@
+import json
+import os
+import sqlite3
+import time
+
+CHECKPOINT_FILENAME = "checkpoint.sqlite"
+# Stages that left products out of a session on purpose, {stage: reason}
+PARTIAL_SNAPSHOT_FILENAME = "partial_snapshot.json"
+
+
+def partial_snapshot(session_dir):
+    """{stage: reason} of the stages that only kept part of the catalogue, empty for a full session"""
+    try:
+        with open(os.path.join(session_dir, PARTIAL_SNAPSHOT_FILENAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def set_partial_snapshot(session_dir, stage, reason=None):
+    """Record why stage left products out of the session (e.g. changed-only sitemaps), or clear it with None.
+
+    Stage 4 reads this to tell products that were not re-fetched from
+    products that are gone.
+    """
+    reasons = partial_snapshot(session_dir)
+    if reason:
+        reasons[stage] = reason
+    elif reasons.pop(stage, None) is None:
+        return
+    path = os.path.join(session_dir, PARTIAL_SNAPSHOT_FILENAME)
+    if reasons:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(reasons, f, indent=2)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class CrawlCheckpoint:
+    """Durable crawl and download progress for one session directory.
+
+    Stage 1 records, per input category (by its position in the input CSV),
+    the next page to fetch, every link kept so far and whether the category
+    is finished, plus the product IDs already tagged as first encounter.
+    Stage 2 records every finished download. Each update is its own SQLite
+    transaction in WAL mode, so a killed run loses at most the page or
+    download that was in progress.
+    """
+
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(str(db_path))
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS categories (
+                idx INTEGER PRIMARY KEY, url TEXT, next_page INTEGER, done INTEGER DEFAULT 0);
+            CREATE TABLE IF NOT EXISTS links (
+                idx INTEGER, seq INTEGER, url TEXT, PRIMARY KEY (idx, seq));
+            CREATE TABLE IF NOT EXISTS seen_products (product_id TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS downloads (
+                url TEXT PRIMARY KEY, filename TEXT, filepath TEXT, finished_at REAL);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        ''')
+        self.db.commit()
+
+    def reset(self):
+        """Forget everything journaled, for a fresh run in a session directory that already has a checkpoint"""
+        with self.db:
+            for table in ('categories', 'links', 'seen_products', 'downloads', 'meta'):
+                self.db.execute(f'DELETE FROM {table}')
+
+    # Stage 1
+
+    def crawl_mode(self):
+        """Crawl mode ('sequential' or 'async') that journaled this session, None if not recorded"""
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'crawl_mode'").fetchone()
+        return row[0] if row else None
+
+    def set_crawl_mode(self, mode):
+        # The two modes journal links and write rows at different points, so a
+        # session can only be resumed by the mode that started it
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('crawl_mode', ?)", (mode,))
+
+    def is_done(self, idx):
+        row = self.db.execute('SELECT done FROM categories WHERE idx = ?', (idx,)).fetchone()
+        return bool(row and row[0])
+
+    def category_state(self, idx):
+        """(next page to fetch, links kept so far in crawl order) for a category"""
+        row = self.db.execute('SELECT next_page FROM categories WHERE idx = ?', (idx,)).fetchone()
+        links = [url for (url,) in self.db.execute(
+            'SELECT url FROM links WHERE idx = ? ORDER BY seq', (idx,))]
+        return (row[0] if row else 1), links
+
+    def seen_products(self):
+        return {product_id for (product_id,) in self.db.execute('SELECT product_id FROM seen_products')}
+
+    def page_done(self, idx, url, next_page, new_links, new_product_ids=()):
+        with self.db:
+            start = self.db.execute('SELECT COUNT(*) FROM links WHERE idx = ?', (idx,)).fetchone()[0]
+            self.db.executemany('INSERT OR IGNORE INTO links VALUES (?, ?, ?)',
+                                ((idx, start + i, link) for i, link in enumerate(new_links)))
+            self.db.executemany('INSERT OR IGNORE INTO seen_products VALUES (?)',
+                                ((product_id,) for product_id in new_product_ids))
+            self.db.execute('''INSERT INTO categories (idx, url, next_page) VALUES (?, ?, ?)
+                               ON CONFLICT(idx) DO UPDATE SET next_page = excluded.next_page''',
+                            (idx, url, next_page))
+
+    def category_done(self, idx, url, new_product_ids=()):
+        with self.db:
+            self.db.executemany('INSERT OR IGNORE INTO seen_products VALUES (?)',
+                                ((product_id,) for product_id in new_product_ids))
+            self.db.execute('''INSERT INTO categories (idx, url, next_page, done) VALUES (?, ?, 0, 1)
+                               ON CONFLICT(idx) DO UPDATE SET done = 1''', (idx, url))
+
+    # Stage 2
+
+    def finished_downloads(self):
+        return {url: (filename, filepath) for url, filename, filepath
+                in self.db.execute('SELECT url, filename, filepath FROM downloads')}
+
+    def download_done(self, url, filename, filepath):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?)',
+                            (url, filename, filepath, time.time()))
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,83 @@
+import threading
+from collections import deque
+from metrics import METRICS
+
+
+class HostFrontiers:
+    """Per-host FIFO frontiers for the async crawl, each drained by that host's own workers.
+
+    add() queues a coroutine function on its host's frontier and returns a
+    future for its result. Once run() starts, every host gets
+    concurrency(host) worker coroutines that only take from its own
+    frontier, so a slow or throttled host ties up its own workers and
+    nobody else's, and every host added to the configuration adds workers.
+    """
+
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.frontiers = {}
+
+    def add(self, host, func, *args):
+        import asyncio
+
+        future = asyncio.get_running_loop().create_future()
+        frontier = self.frontiers.get(host)
+        if frontier is None:
+            frontier = self.frontiers[host] = deque()
+            METRICS.gauge_callback('queue_depth', frontier.__len__, queue=f'frontier:{host}')
+        frontier.append((future, func, args))
+        return future
+
+    async def _work(self, frontier):
+        while frontier:
+            future, func, args = frontier.popleft()
+            try:
+                future.set_result(await func(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+    async def run(self):
+        """Drain every frontier; results and errors go to the futures add() returned"""
+        import asyncio
+
+        workers = [self._work(frontier) for host, frontier in self.frontiers.items()
+                   for _ in range(max(1, min(self.concurrency(host), len(frontier))))]
+        await asyncio.gather(*workers)
+
+
+class HostPoolExecutor:
+    """Executor with a thread pool per host, so a slow host only ever occupies its own threads.
+
+    submit() finds the host with host_of(*args) and hands the call to that
+    host's pool, created on first use with workers_for_host(host) threads.
+    It can stand in for a ThreadPoolExecutor, e.g. under a RetryScheduler.
+    """
+
+    def __init__(self, host_of, workers_for_host):
+        self.host_of = host_of
+        self.workers_for_host = workers_for_host
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        host = self.host_of(*args)
+        with self.lock:
+            pool = self.pools.get(host)
+            if pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                pool = self.pools[host] = ThreadPoolExecutor(max_workers=self.workers_for_host(host),
+                                                             thread_name_prefix=f'worker-{host}')
+        return pool.submit(func, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            pools = list(self.pools.values())
+        for pool in pools:
+            pool.shutdown(wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
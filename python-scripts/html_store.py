@@ -0,0 +1,140 @@
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compression used for new blobs; readers go by the codec stored per blob
+DEFAULT_CODEC = 'zstd' if zstandard is not None else 'gzip'
+
+
+def compress(data, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def decompress(data, codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("pack contains zstd blobs, install the zstandard package to read them")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+class HTMLPackStore:
+    """Append-only, content-addressed store for downloaded pages.
+
+    Compressed bodies are appended to pages.pack. index.sqlite maps a content
+    hash to its (offset, length, codec) in the pack, and (session, key) to the
+    hash, where session is the timestamped run directory and key the file
+    name the page would have had on disk (e.g. 397647.html). A body already
+    in the pack, from this run or any earlier one, is only indexed again,
+    never written twice.
+
+    With read_only=True an existing store is opened for reading only (the
+    scraper side): nothing is created and put() is not available.
+    """
+
+    def __init__(self, store_dir, session, codec=DEFAULT_CODEC, read_only=False):
+        self.store_dir = str(store_dir)
+        self.session = session
+        self.codec = codec
+        self.pack_path = os.path.join(self.store_dir, 'pages.pack')
+        index_path = os.path.join(self.store_dir, 'index.sqlite')
+        self.lock = threading.Lock()
+        if read_only:
+            if not os.path.exists(index_path):
+                raise FileNotFoundError(f"No pack store found in {self.store_dir}")
+            self.db = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True, check_same_thread=False)
+            self.pack = open(self.pack_path, 'rb')
+        else:
+            os.makedirs(self.store_dir, exist_ok=True)
+            self.db = sqlite3.connect(index_path, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY, offset INTEGER, length INTEGER, codec TEXT, raw_size INTEGER)''')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS pages (
+                session TEXT, key TEXT, url TEXT, hash TEXT, stored_at TEXT,
+                PRIMARY KEY (session, key))''')
+            self.db.commit()
+            self.pack = open(self.pack_path, 'ab')
+        self.new_blobs = 0
+        self.deduplicated = 0
+
+    def location(self, key):
+        """Value used in place of a file path in the CSVs"""
+        return f"{self.pack_path}#{self.session}/{key}"
+
+    def contains(self, key):
+        with self.lock:
+            row = self.db.execute('SELECT 1 FROM pages WHERE session = ? AND key = ?',
+                                  (self.session, key)).fetchone()
+        return row is not None
+
+    def put(self, key, url, html):
+        data = html.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            known = self.db.execute('SELECT 1 FROM blobs WHERE hash = ?', (digest,)).fetchone()
+        blob = None if known else compress(data, self.codec)
+        with self.lock:
+            # Another thread may have stored the same body in the meantime
+            known = self.db.execute('SELECT 1 FROM blobs WHERE hash = ?', (digest,)).fetchone()
+            if known:
+                self.deduplicated += 1
+            else:
+                offset = self.pack.seek(0, os.SEEK_END)
+                self.pack.write(blob)
+                self.pack.flush()
+                self.db.execute('INSERT INTO blobs VALUES (?, ?, ?, ?, ?)',
+                                (digest, offset, len(blob), self.codec, len(data)))
+                self.new_blobs += 1
+            self.db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)',
+                            (self.session, key, url, digest, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            self.db.commit()
+        return digest
+
+    def _read_blob(self, reader, offset, length, codec):
+        reader.seek(offset)
+        return decompress(reader.read(length), codec).decode('utf-8')
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute(
+                '''SELECT b.offset, b.length, b.codec FROM pages p JOIN blobs b ON b.hash = p.hash
+                   WHERE p.session = ? AND p.key = ?''', (self.session, key)).fetchone()
+        if row is None:
+            return None
+        with open(self.pack_path, 'rb') as reader:
+            return self._read_blob(reader, *row)
+
+    def entries(self):
+        """(key, content hash) for every page of the session"""
+        with self.lock:
+            return self.db.execute(
+                'SELECT key, hash FROM pages WHERE session = ? ORDER BY key', (self.session,)).fetchall()
+
+    def iter_pages(self):
+        """Yield (key, html) for the session, reading the pack front to back"""
+        with self.lock:
+            rows = self.db.execute(
+                '''SELECT p.key, b.offset, b.length, b.codec FROM pages p JOIN blobs b ON b.hash = p.hash
+                   WHERE p.session = ? ORDER BY b.offset''', (self.session,)).fetchall()
+        with open(self.pack_path, 'rb') as reader:
+            for key, offset, length, codec in rows:
+                yield key, self._read_blob(reader, offset, length, codec)
+
+    def format_stats(self):
+        return f"{self.new_blobs} new pages packed, {self.deduplicated} deduplicated"
+
+    def close(self):
+        with self.lock:
+            self.pack.close()
+            self.db.close()
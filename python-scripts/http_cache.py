@@ -0,0 +1,155 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+
+# Defaults for the on-disk cache shared by stage 1 and stage 2
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+MAX_CACHE_AGE_DAYS = 14
+
+
+def cache_key(url):
+    """normalize_url() plus a sorted query string.
+
+    Listing pages only differ by ?p=N, so unlike normalize_url the query has
+    to stay part of the key.
+    """
+    parsed = urlparse(url)
+    query = urlencode(sorted(parse_qsl(parsed.query, keep_blank_values=True)))
+    return urlunparse((parsed.scheme, parsed.netloc, parsed.path, '', query, ''))
+
+
+class HTTPCache:
+    """Conditional-GET cache: validators and gzipped bodies stored per URL on disk.
+
+    Each entry is <sha1>.json (url, ETag, Last-Modified, encoding, timestamps)
+    next to <sha1>.html.gz. Entries are evicted by age since they were last
+    validated and, oldest first, once the cache grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=MAX_CACHE_BYTES, max_age_days=MAX_CACHE_AGE_DAYS):
+        self.cache_dir = str(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self.stats_lock = threading.Lock()
+
+    def _paths(self, url):
+        digest = hashlib.sha1(cache_key(url).encode('utf-8')).hexdigest()
+        folder = os.path.join(self.cache_dir, digest[:2])
+        return os.path.join(folder, digest + '.json'), os.path.join(folder, digest + '.html.gz')
+
+    def lookup(self, url):
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if time.time() - meta.get('validated_at', 0) > self.max_age or not os.path.exists(body_path):
+            return None
+        return meta
+
+    def conditional_headers(self, url):
+        meta = self.lookup(url)
+        headers = {}
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def load(self, url):
+        """Cached body as bytes plus its encoding, or (None, None)"""
+        meta = self.lookup(url)
+        if not meta:
+            return None, None
+        _, body_path = self._paths(url)
+        try:
+            with gzip.open(body_path, 'rb') as f:
+                return f.read(), meta.get('encoding')
+        except (OSError, EOFError):
+            return None, None
+
+    def revalidated(self, url):
+        """A 304 came back: count the hit and restart the entry's age"""
+        with self.stats_lock:
+            self.hits += 1
+        meta_path, _ = self._paths(url)
+        meta = self.lookup(url)
+        if meta:
+            meta['validated_at'] = time.time()
+            self._write_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+
+    def store(self, url, headers, body, encoding=None):
+        """Keep a 200 response that carries at least one validator"""
+        with self.stats_lock:
+            self.misses += 1
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+        meta_path, body_path = self._paths(url)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        self._write_atomic(body_path, gzip.compress(body, compresslevel=6))
+        meta = {
+            'url': cache_key(url),
+            'etag': etag,
+            'last_modified': last_modified,
+            'encoding': encoding,
+            'validated_at': time.time(),
+        }
+        self._write_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+
+    def _write_atomic(self, path, data):
+        # Worker threads may race on the same entry, readers must never see half a file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def prune(self):
+        """Drop expired entries, then the least recently validated ones until under max_bytes"""
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        now = time.time()
+        entries = []
+        removed = 0
+        for folder, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                meta_path = os.path.join(folder, name)
+                body_path = meta_path[:-len('.json')] + '.html.gz'
+                try:
+                    with open(meta_path, 'r', encoding='utf-8') as f:
+                        validated_at = json.load(f).get('validated_at', 0)
+                    size = os.path.getsize(body_path) + os.path.getsize(meta_path)
+                except (OSError, ValueError):
+                    validated_at, size = 0, 0
+                entries.append((validated_at, size, meta_path, body_path))
+        entries.sort()
+        total = sum(entry[1] for entry in entries)
+        for validated_at, size, meta_path, body_path in entries:
+            if now - validated_at <= self.max_age and total <= self.max_bytes:
+                break
+            for path in (meta_path, body_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+    def format_stats(self):
+        return f"{self.hits} not modified (304), {self.misses} downloaded"
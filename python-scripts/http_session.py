@@ -0,0 +1,204 @@
+import functools
+import threading
+import time
+from rate_limiter import parse_retry_after
+from metrics import METRICS
+
+# Connections kept alive per host in each worker's session
+POOL_SIZE = 4
+
+_local = threading.local()
+_sessions = []
+_sessions_lock = threading.Lock()
+_pool_size = POOL_SIZE
+_stats = {'connections': 0, 'requests': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+@functools.lru_cache(maxsize=None)
+def accept_encoding():
+    """Accept-Encoding of the requests sessions.
+
+    urllib3 lists br (and zstd) only when the decoder package is installed,
+    so we never advertise an encoding we could not decompress.
+    """
+    from urllib3.util.request import ACCEPT_ENCODING as URLLIB3_ACCEPT_ENCODING
+
+    return URLLIB3_ACCEPT_ENCODING.replace(',', ', ')
+
+
+def async_accept_encoding():
+    # aiohttp decodes brotli through the same package but has no zstd support
+    return ', '.join(e for e in accept_encoding().split(', ') if e != 'zstd')
+
+
+@functools.lru_cache(maxsize=None)
+def counting_adapter_class():
+    """HTTPAdapter whose pools count every connection they open.
+
+    Built on first use, so importing this module does not load requests and
+    urllib3.
+    """
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class CountingHTTPConnection(HTTPConnection):
+        # connect() runs once per TCP (and TLS) handshake, including reconnects of
+        # a pooled connection the server closed
+        def connect(self):
+            _count('connections')
+            super().connect()
+
+    class CountingHTTPSConnection(HTTPSConnection):
+        def connect(self):
+            _count('connections')
+            super().connect()
+
+    class CountingHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = CountingHTTPConnection
+
+    class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = CountingHTTPSConnection
+
+    class CountingHTTPAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                'http': CountingHTTPConnectionPool,
+                'https': CountingHTTPSConnectionPool,
+            }
+
+    return CountingHTTPAdapter
+
+
+def configure(pool_size=POOL_SIZE):
+    """Set the pool size used for sessions created from now on"""
+    global _pool_size
+    _pool_size = pool_size
+
+
+def get_session():
+    """Return the calling thread's session, creating it on first use.
+
+    requests.Session is not safe to share between threads, so every worker
+    thread gets its own session with its own keep-alive pool.
+    """
+    session = getattr(_local, 'session', None)
+    if session is None:
+        import requests
+
+        session = requests.Session()
+        adapter = counting_adapter_class()(pool_connections=_pool_size, pool_maxsize=_pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['Accept-Encoding'] = accept_encoding()
+        session.headers['Connection'] = 'keep-alive'
+        _local.session = session
+        with _sessions_lock:
+            _sessions.append(session)
+    return session
+
+
+def fetch(url, headers=None, timeout=15, limiter=None, cache=None, stream=False):
+    """GET url on the thread's pooled session, throttled and reported through limiter.
+
+    With a cache the request is made conditional. A 304 is turned into a 200
+    carrying the cached body, with response.from_cache set to True. Streamed
+    responses (stream=True) bypass the cache; the caller reads response.raw
+    and closes the response.
+    """
+    if stream:
+        cache = None
+    session = get_session()
+    headers = dict(headers or {})
+    if cache is not None:
+        headers.update(cache.conditional_headers(url))
+    if limiter is not None:
+        limiter.acquire(url)
+    started = time.monotonic()
+    _count('requests')
+    try:
+        response = session.get(url, headers=headers, timeout=timeout, stream=stream)
+    except Exception as e:
+        if limiter is not None:
+            limiter.record(url)
+        METRICS.record_request(url, seconds=time.monotonic() - started, error=e)
+        raise
+    elapsed = time.monotonic() - started
+    if limiter is not None:
+        limiter.record(url, response.status_code, elapsed,
+                       parse_retry_after(response.headers.get('Retry-After')))
+    METRICS.record_request(url, response.status_code, elapsed, 0 if stream else len(response.content))
+    response.from_cache = False
+    if cache is not None:
+        if response.status_code == 304:
+            body, encoding = cache.load(url)
+            if body is not None:
+                cache.revalidated(url)
+                response.status_code = 200
+                response._content = body
+                response.encoding = encoding
+                response.from_cache = True
+        elif response.status_code == 200:
+            cache.store(url, response.headers, response.content, response.encoding)
+    return response
+
+
+def connection_stats():
+    """Connections opened vs requests sent over every session created so far"""
+    with _sessions_lock:
+        sessions = len(_sessions)
+    with _stats_lock:
+        connections = _stats['connections']
+        sent = _stats['requests']
+    return {
+        'sessions': sessions,
+        'connections': connections,
+        'requests': sent,
+        'reused': max(0, sent - connections),
+    }
+
+
+def format_stats(stats):
+    return (f"{stats['requests']} requests over {stats['connections']} connections "
+            f"({stats['reused']} reused, {stats['sessions']} sessions)")
+
+
+def create_async_session(concurrency, per_host, timeout=15):
+    """aiohttp session with a shared connector, plus a connection reuse counter dict.
+
+    The counters are filled in from aiohttp's connection tracing hooks and use
+    the same keys as connection_stats().
+    """
+    import aiohttp
+
+    stats = {'sessions': 1, 'connections': 0, 'requests': 0, 'reused': 0}
+
+    async def on_request_start(session, context, params):
+        stats['requests'] += 1
+
+    async def on_connection_create_end(session, context, params):
+        stats['connections'] += 1
+
+    async def on_connection_reuseconn(session, context, params):
+        stats['reused'] += 1
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host)
+    session = aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=timeout),
+        headers={'Accept-Encoding': async_accept_encoding()},
+        trace_configs=[trace_config],
+    )
+    return session, stats
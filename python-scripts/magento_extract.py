@@ -0,0 +1,76 @@
+import html as html_lib
+import json
+import re
+
+PRODUCT_FORM_KEY = '#product_addtocart_form'
+MAGENTO_INIT_RE = re.compile(r'''<script\b[^>]*\btype\s*=\s*["']text/x-magento-init["'][^>]*>''', re.IGNORECASE)
+TITLE_RE = re.compile(r'<title\b[^>]*>(.*?)</title\s*>', re.IGNORECASE | re.DOTALL)
+
+
+def fast_title(html_content):
+    match = TITLE_RE.search(html_content)
+    if not match:
+        return None
+    title = match.group(1)
+    if '<' in title:
+        # Markup inside <title>, leave it to the full parser
+        return None
+    # A blank title is read by the full parser, as it always was
+    return html_lib.unescape(title).strip() or None
+
+
+def fast_product_options(html_content):
+    """Decode the x-magento-init block holding #product_addtocart_form by scanning the raw HTML.
+
+    Every occurrence of the form key is walked back to the nearest <script>
+    tag; if that tag is a text/x-magento-init script, its body up to
+    </script> is decoded as JSON. Returns None when no such block parses.
+    """
+    pos = html_content.find(PRODUCT_FORM_KEY)
+    while pos != -1:
+        script_start = html_content.rfind('<script', 0, pos)
+        if script_start != -1:
+            tag = MAGENTO_INIT_RE.match(html_content, script_start)
+            # The key must sit inside this script, not after an earlier one closed
+            if tag and html_content.find('</script', tag.end(), pos) == -1:
+                script_end = html_content.find('</script', pos)
+                if script_end != -1:
+                    try:
+                        data = json.loads(html_content[tag.end():script_end])
+                    except ValueError:
+                        data = None
+                    if isinstance(data, dict) and PRODUCT_FORM_KEY in data:
+                        return data
+        pos = html_content.find(PRODUCT_FORM_KEY, pos + len(PRODUCT_FORM_KEY))
+    return None
+
+
+def soup_page_fields(html_content):
+    """Full-parse path: (product name, magento init data) the way the scraper always read them"""
+    # Only pages the scan cannot read get here, so bs4 is imported on first use
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html_content, 'html.parser')
+    scripts = soup.find_all('script', {'type': 'text/x-magento-init'})
+    product_name = soup.title.string.strip() if soup.title else "Unknown Product"
+    product_options_data = None
+    for script in scripts:
+        if script.string and PRODUCT_FORM_KEY in script.string:
+            try:
+                product_options_data = json.loads(script.string)
+                break
+            except Exception:
+                continue
+    return product_name, product_options_data
+
+
+def extract_page_fields(html_content):
+    """(product name, magento init data), scanning first and parsing the whole page only if that fails"""
+    product_options_data = fast_product_options(html_content)
+    if product_options_data is not None:
+        product_name = fast_title(html_content)
+        if product_name is not None:
+            return product_name, product_options_data
+        if not TITLE_RE.search(html_content):
+            return "Unknown Product", product_options_data
+    return soup_page_fields(html_content)
@@ -0,0 +1,270 @@
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+# Upper bounds, in seconds, of the latency and parse-time histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LOG_FORMAT = '%(asctime)s %(levelname)-7s %(name)s: %(message)s'
+SNAPSHOT_INTERVAL = 10.0
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    """Counters, gauges and histograms for one process, keyed by name and labels.
+
+    Gauges can also be callbacks evaluated when a snapshot is taken, which is
+    how queue depths are sampled without touching the queues' hot paths.
+    Counters named *rows_total and *pages_total are also reported as rates
+    per second since the registry was created.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.gauge_callbacks = {}
+        self.histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def gauge_callback(self, name, callback, **labels):
+        with self.lock:
+            self.gauge_callbacks[self._key(name, labels)] = callback
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def record_request(self, url, status=None, seconds=None, nbytes=0, error=None):
+        """One HTTP exchange: latency, status (or error type) and body bytes, per host"""
+        host = urlparse(url).netloc
+        if seconds is not None:
+            self.observe('http_request_seconds', seconds, host=host)
+        if error is not None:
+            self.inc('http_errors_total', host=host, error=type(error).__name__)
+        else:
+            self.inc('http_responses_total', host=host, status=str(status))
+        if nbytes:
+            self.inc('http_response_bytes_total', nbytes, host=host)
+
+    def _gauge_values(self):
+        values = dict(self.gauges)
+        for key, callback in self.gauge_callbacks.items():
+            try:
+                values[key] = callback()
+            except Exception:
+                continue
+        return values
+
+    def snapshot(self):
+        """All current values as a JSON-serializable dict"""
+        def label_str(labels):
+            return ','.join(f'{k}={v}' for k, v in labels)
+
+        with self.lock:
+            uptime = time.time() - self.started
+            snapshot = {'timestamp': time.time(), 'uptime_seconds': round(uptime, 3),
+                        'counters': {}, 'rates': {}, 'gauges': {}, 'histograms': {}}
+            for (name, labels), value in sorted(self.counters.items()):
+                snapshot['counters'].setdefault(name, {})[label_str(labels)] = value
+                if name.endswith(('rows_total', 'pages_total')) and uptime > 0:
+                    rate_name = name[:-len('_total')] + '_per_second'
+                    snapshot['rates'].setdefault(rate_name, {})[label_str(labels)] = round(value / uptime, 3)
+            for (name, labels), value in sorted(self._gauge_values().items()):
+                snapshot['gauges'].setdefault(name, {})[label_str(labels)] = value
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                snapshot['histograms'].setdefault(name, {})[label_str(labels)] = {
+                    'count': histogram.count,
+                    'sum': round(histogram.sum, 6),
+                    'p50': histogram.quantile(0.5),
+                    'p90': histogram.quantile(0.9),
+                    'p99': histogram.quantile(0.99),
+                }
+        return snapshot
+
+    def render_prometheus(self):
+        """Values in the Prometheus text exposition format"""
+        def label_str(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f'# TYPE {name} counter')
+                    typed.add(name)
+                lines.append(f'{name}{label_str(labels)} {value}')
+            for (name, labels), value in sorted(self._gauge_values().items()):
+                if name not in typed:
+                    lines.append(f'# TYPE {name} gauge')
+                    typed.add(name)
+                lines.append(f'{name}{label_str(labels)} {value}')
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f'# TYPE {name} histogram')
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{label_str(labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_bucket{label_str(labels, [("le", "+Inf")])} {histogram.count}')
+                lines.append(f'{name}_sum{label_str(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{label_str(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def format_summary(self):
+        """One line per stage: rows/sec, pages/sec and request latency percentiles"""
+        snapshot = self.snapshot()
+        parts = [f"{snapshot['uptime_seconds']:.1f}s"]
+        for name, values in snapshot['rates'].items():
+            for labels, rate in values.items():
+                parts.append(f"{name}[{labels}]={rate}")
+        for labels, stats in snapshot['histograms'].get('http_request_seconds', {}).items():
+            parts.append(f"latency[{labels}] p50<={stats['p50']}s p99<={stats['p99']}s n={stats['count']}")
+        return ', '.join(parts)
+
+
+# Registry shared by every module of the process
+METRICS = Metrics()
+
+
+def serve_metrics(port, host='127.0.0.1'):
+    """Serve /metrics (Prometheus text) and /metrics.json from a daemon thread"""
+    # http.server is slow to import and only needed when --metrics-port is given
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] == '/metrics':
+                body = METRICS.render_prometheus().encode()
+                content_type = 'text/plain; version=0.0.4'
+            elif self.path.split('?')[0] == '/metrics.json':
+                body = json.dumps(METRICS.snapshot()).encode()
+                content_type = 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+
+class SnapshotWriter:
+    """Append a JSON snapshot line to path every interval seconds, and once more on close"""
+
+    def __init__(self, path, interval=SNAPSHOT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='metrics-snapshots', daemon=True)
+        self.thread.start()
+
+    def write(self):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(METRICS.snapshot()) + '\n')
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.write()
+
+
+def add_arguments(parser):
+    """--log-level, --metrics-port, --metrics-json and --metrics-interval for a stage's CLI"""
+    parser.add_argument('--log-level', default='INFO', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                        help="DEBUG also logs every page and file")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="serve Prometheus-style metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument('--metrics-json', default=None, metavar='PATH',
+                        help="append a JSON metrics snapshot to PATH periodically")
+    parser.add_argument('--metrics-interval', type=float, default=SNAPSHOT_INTERVAL,
+                        help="seconds between JSON snapshots")
+
+
+def setup(args):
+    """Configure logging and start the metrics outputs requested on the command line.
+
+    Returns a function to call at exit: it writes the final snapshot and logs
+    a one-line summary.
+    """
+    logging.basicConfig(level=getattr(logging, args.log_level), format=LOG_FORMAT)
+    server = serve_metrics(args.metrics_port) if args.metrics_port else None
+    writer = SnapshotWriter(args.metrics_json, args.metrics_interval) if args.metrics_json else None
+
+    def finish():
+        if writer is not None:
+            writer.close()
+        if server is not None:
+            server.shutdown()
+        logging.getLogger(__name__).info("Metrics: %s", METRICS.format_summary())
+
+    return finish
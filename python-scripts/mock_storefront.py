@@ -0,0 +1,238 @@
+import argparse
+import gzip
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Category listings and product pages shaped like cl.puma.com's Magento theme
+CATEGORY_RE = re.compile(r'^/([a-z]+)/zapatillas/cat-(\d+)\.html$')
+PRODUCT_RE = re.compile(r'^/[a-z0-9-]+-(\d+)-(\d+)\.html$')
+SITEMAP_RE = re.compile(r'^/sitemap-(\d+)\.xml\.gz$')
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+SIZES = ('38', '39', '40', '41', '42', '43')
+COLORS = ('Negro', 'Blanco', 'Azul', 'Rojo', 'Gris', 'Verde')
+# Product IDs start here, so they look like real 6-digit Puma style numbers
+FIRST_PRODUCT_ID = 390000
+
+
+class MockStorefront:
+    """Local stand-in for the Puma storefront, for benchmarks and tests.
+
+    Serves categories /<gender>/zapatillas/cat-<n>.html with ?p= pagination
+    (pages past the last one repeat it, as Magento does) and product pages
+    /<slug>-<id>-01.html carrying a text/x-magento-init spConfig blob.
+    /sitemap.xml is a sitemap index with one gzipped child per category,
+    /sitemap-<n>.xml.gz; every entry carries lastmod (an ISO 8601 string,
+    change it between runs to test changed-only discovery). latency adds a delay to every response, error_rate answers that share
+    of requests with a 503, and page_bytes pads product pages to a realistic
+    size. Responses are deterministic for a given seed; only the injected
+    errors depend on request order.
+    """
+
+    def __init__(self, categories=4, products_per_category=240, page_size=24, colors=3, sizes=4,
+                 latency=0.0, error_rate=0.0, page_bytes=250_000, seed=0, host='127.0.0.1', port=0,
+                 lastmod='2024-01-01T00:00:00+00:00'):
+        self.categories = categories
+        self.products_per_category = products_per_category
+        self.page_size = page_size
+        self.colors = colors
+        self.sizes = sizes
+        self.latency = latency
+        self.error_rate = error_rate
+        self.page_bytes = page_bytes
+        self.seed = seed
+        self.lastmod = lastmod
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'category': 0, 'product': 0, 'sitemap': 0, 'errors': 0, 'not_found': 0}
+        storefront = self
+
+        class Handler(_StorefrontHandler):
+            store = storefront
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def host(self):
+        host, port = self.server.server_address[:2]
+        return f'{host}:{port}'
+
+    @property
+    def base_url(self):
+        return f'http://{self.host}'
+
+    def category_urls(self):
+        genders = ('hombres', 'mujeres')
+        return [f'{self.base_url}/{genders[c % 2]}/zapatillas/cat-{c}.html' for c in range(self.categories)]
+
+    @property
+    def sitemap_url(self):
+        return f'{self.base_url}/sitemap.xml'
+
+    def product_ids(self, category):
+        start = FIRST_PRODUCT_ID + category * self.products_per_category
+        return range(start, start + self.products_per_category)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='mock-storefront', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def count(self, kind):
+        with self.lock:
+            self.stats[kind] += 1
+
+    def should_fail(self):
+        if not self.error_rate:
+            return False
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def navigation(self):
+        """Header links repeated on every page, like the real site's menu"""
+        links = [f'<a href="/{gender}.html">{gender}</a>' for gender in ('hombres', 'mujeres')]
+        links += [f'<a href="{url}">cat</a>' for url in self.category_urls()]
+        return '<nav>' + ''.join(links) + '<a href="/privacy-policy.html">privacidad</a></nav>'
+
+    def category_page(self, category, page):
+        ids = self.product_ids(category)
+        last_page = max(1, -(-len(ids) // self.page_size))
+        page = min(max(page, 1), last_page)
+        tiles = ''.join(
+            f'<li class="product-item"><a href="/zapatilla-modelo-{product_id}-01.html">'
+            f'Zapatilla {product_id}</a></li>'
+            for product_id in ids[(page - 1) * self.page_size:page * self.page_size]
+        )
+        return (f'<html><head><title>Categoria {category}</title></head><body>{self.navigation()}'
+                f'<ol class="products">{tiles}</ol></body></html>')
+
+    def sitemap_index(self):
+        entries = ''.join(f'<sitemap><loc>{self.base_url}/sitemap-{c}.xml.gz</loc><lastmod>{self.lastmod}</lastmod>'
+                          f'</sitemap>' for c in range(self.categories))
+        return f'<?xml version="1.0" encoding="UTF-8"?><sitemapindex xmlns="{SITEMAP_NS}">{entries}</sitemapindex>'
+
+    def category_sitemap(self, category):
+        entries = ''.join(f'<url><loc>{self.base_url}/zapatilla-modelo-{product_id}-01.html</loc>'
+                          f'<lastmod>{self.lastmod}</lastmod></url>' for product_id in self.product_ids(category))
+        return f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="{SITEMAP_NS}">{entries}</urlset>'
+
+    def product_page(self, product_id):
+        rng = random.Random(self.seed * 1_000_003 + product_id)
+        sizes = SIZES[:self.sizes]
+        attributes = {
+            '93': {'code': 'tinte', 'options': []},
+            '150': {'code': 'talla', 'options': [{'label': size, 'all_products': [], 'out_of_stock': []}
+                                                 for size in sizes]},
+        }
+        prices = {}
+        base_price = rng.choice((39990, 49990, 59990, 79990))
+        for c in range(self.colors):
+            color = {'label': COLORS[c % len(COLORS)], 'products': []}
+            for s, size_option in enumerate(attributes['150']['options']):
+                sku = str(product_id * 100 + c * 10 + s)
+                color['products'].append(sku)
+                size_option['all_products'].append(sku)
+                if rng.random() < 0.2:
+                    size_option['out_of_stock'].append(sku)
+                final_price = base_price if rng.random() < 0.5 else int(base_price * 0.7)
+                prices[sku] = {'oldPrice': {'amount': base_price}, 'finalPrice': {'amount': final_price}}
+            attributes['93']['options'].append(color)
+        config = {'#product_addtocart_form': {'configurable': {'spConfig': {
+            'attributes': attributes, 'optionPrices': prices,
+            'currencySymbol': '$', 'basePrice': {'amount': base_price}}}}}
+        head = (f'<html><head><title> Zapatilla Modelo {product_id} </title>'
+                f'<script type="text/x-magento-init">{{"*": {{"Magento_Ui/js/core/app": {{}}}}}}</script>'
+                f'</head><body>{self.navigation()}')
+        tail = f'<script type="text/x-magento-init">{json.dumps(config)}</script></body></html>'
+        filler = '<div class="block">Lorem ipsum dolor sit amet</div>'
+        padding = filler * max(0, (self.page_bytes - len(head) - len(tail)) // len(filler))
+        return head + padding + tail
+
+
+class _StorefrontHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Keep-alive responses are written in several sends; without TCP_NODELAY each
+    # one waits on the client's delayed ACK (~40 ms) and the benchmark measures that
+    disable_nagle_algorithm = True
+    store = None
+
+    def do_GET(self):
+        store = self.store
+        if store.latency:
+            time.sleep(store.latency)
+        path, _, query = self.path.partition('?')
+        if store.should_fail():
+            store.count('errors')
+            self._send(503, b'Service Unavailable', {'Retry-After': '1'})
+            return
+        category = CATEGORY_RE.match(path)
+        product = PRODUCT_RE.match(path)
+        sitemap = SITEMAP_RE.match(path)
+        if path == '/sitemap.xml':
+            store.count('sitemap')
+            self._send(200, store.sitemap_index().encode('utf-8'), {'Content-Type': 'application/xml'})
+            return
+        if sitemap and int(sitemap.group(1)) < store.categories:
+            store.count('sitemap')
+            body = gzip.compress(store.category_sitemap(int(sitemap.group(1))).encode('utf-8'))
+            self._send(200, body, {'Content-Type': 'application/gzip'})
+            return
+        if category and int(category.group(2)) < store.categories:
+            store.count('category')
+            page = re.search(r'(?:^|&)p=(\d+)', query)
+            body = store.category_page(int(category.group(2)), int(page.group(1)) if page else 1)
+        elif product:
+            store.count('product')
+            body = store.product_page(int(product.group(1)))
+        else:
+            store.count('not_found')
+            self._send(404, b'Not Found')
+            return
+        self._send(200, body.encode('utf-8'), {'Content-Type': 'text/html; charset=UTF-8'})
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a synthetic Puma-like Magento storefront locally.")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--categories', type=int, default=4)
+    parser.add_argument('--products', type=int, default=240, help="products per category")
+    parser.add_argument('--page-size', type=int, default=24, help="products per listing page")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument('--page-kb', type=int, default=250, help="approximate product page size")
+    args = parser.parse_args()
+    storefront = MockStorefront(args.categories, args.products, args.page_size, latency=args.latency,
+                                error_rate=args.error_rate, page_bytes=args.page_kb * 1000, port=args.port)
+    print(f"🛍️ Serving {args.categories * args.products} products on {storefront.base_url}")
+    for url in storefront.category_urls():
+        print(url)
+    try:
+        storefront.server.serve_forever()
+    except KeyboardInterrupt:
+        storefront.server.server_close()
@@ -0,0 +1,106 @@
+import os
+import re
+import uuid
+from datetime import datetime
+
+# Price strings come out of the scraper as f"{currency}{amount}", e.g. "$29990"
+PRICE_RE = re.compile(r'^\s*(.*?)\s*(-?\d+(?:\.\d+)?)\s*$')
+
+
+def split_price(value):
+    """'$29990' -> ('$', 29990.0); anything without a number -> (None, None)"""
+    match = PRICE_RE.match(value or '')
+    if not match:
+        return None, None
+    return match.group(1) or None, float(match.group(2))
+
+
+def row_schema():
+    """Arrow schema of the SKU rows, shared by the sink and the price-history stage"""
+    import pyarrow as pa
+
+    categorical = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('html_filename', pa.string()),
+        ('color', categorical),
+        ('size', categorical),
+        ('sku', pa.string()),
+        ('availability', categorical),
+        ('currency', categorical),
+        ('original_price', pa.float64()),
+        ('discounted_price', pa.float64()),
+        ('product_name', pa.string()),
+        ('extraction_datetime', pa.timestamp('s')),
+        ('currency_code', categorical),
+    ])
+
+
+class ParquetSink:
+    """Batched, typed Parquet output for the scraper's SKU rows.
+
+    Rows are buffered and written every batch_size rows as one file per
+    extraction date, under <root_dir>/extraction_date=YYYY-MM-DD/, so readers
+    that filter on the date (pyarrow.dataset, pandas, DuckDB...) only open
+    the partitions they need. Prices are stored as numbers with the currency
+    symbol in its own column, next to the storefront's ISO currency_code;
+    availability, color, size and both currency columns are dictionary
+    encoded.
+    """
+
+    def __init__(self, root_dir, batch_size=50000):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.pq = pq
+        self.root_dir = str(root_dir)
+        self.batch_size = batch_size
+        self.run_id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.parts = 0
+        self.rows_written = 0
+        self.buffer = []
+        self.schema = row_schema()
+
+    def add_rows(self, rows):
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        by_date = {}
+        for row in self.buffer:
+            by_date.setdefault(row[8][:10], []).append(row)
+        self.buffer = []
+        for extraction_date, rows in by_date.items():
+            self._write_partition(extraction_date, rows)
+
+    def _write_partition(self, extraction_date, rows):
+        columns = {name: [] for name in self.schema.names}
+        for (filename, color, size, sku, availability, original, discounted, product_name, extracted,
+             currency_code) in rows:
+            currency, original_price = split_price(original)
+            discounted_currency, discounted_price = split_price(discounted)
+            columns['html_filename'].append(filename)
+            columns['color'].append(color)
+            columns['size'].append(size)
+            columns['sku'].append(sku)
+            columns['availability'].append(availability)
+            columns['currency'].append(currency or discounted_currency)
+            columns['original_price'].append(original_price)
+            columns['discounted_price'].append(discounted_price)
+            columns['product_name'].append(product_name)
+            columns['extraction_datetime'].append(datetime.strptime(extracted, "%Y-%m-%d %H:%M:%S"))
+            columns['currency_code'].append(currency_code or None)
+        table = self.pa.table(columns, schema=self.schema)
+        partition_dir = os.path.join(self.root_dir, f"extraction_date={extraction_date}")
+        os.makedirs(partition_dir, exist_ok=True)
+        self.parts += 1
+        path = os.path.join(partition_dir, f"part-{self.run_id}-{self.parts:05d}.parquet")
+        self.pq.write_table(table, path, compression='zstd')
+        self.rows_written += len(rows)
+
+    def close(self):
+        self.flush()
+        return self.rows_written
@@ -0,0 +1,166 @@
+import mmap
+import os
+import threading
+from datetime import date
+
+# Mapped files grow in steps of this many entries
+GROW_STEP = 1 << 20
+# Day numbers in fetched.days count from here; 0 means never fetched
+EPOCH = date(2020, 1, 1)
+# Storage is sized to the largest ID, so longer IDs are rejected: at this bound
+# a bitmap is 12.5 MB and fetched.days a 200 MB sparse file
+MAX_PRODUCT_ID_DIGITS = 8
+MAX_PRODUCT_ID = 10 ** MAX_PRODUCT_ID_DIGITS - 1
+
+
+def check_product_id(product_id):
+    """product_id as an int, ValueError when it is outside 0..MAX_PRODUCT_ID"""
+    product_id = int(product_id)
+    if not 0 <= product_id <= MAX_PRODUCT_ID:
+        raise ValueError(f"Product ID out of range: {product_id}")
+    return product_id
+
+
+class IdBitmap:
+    """In-memory set of integer product IDs, one bit per ID.
+
+    Accepts the digit strings the crawler extracts as well as ints, so it can
+    stand in for the per-run set of product ID strings.
+    """
+
+    def __init__(self, size=GROW_STEP):
+        self.bits = bytearray((size + 7) // 8)
+
+    def _grow(self, product_id):
+        needed = (product_id // GROW_STEP + 1) * GROW_STEP // 8
+        if needed > len(self.bits):
+            self.bits.extend(bytes(needed - len(self.bits)))
+
+    def __contains__(self, product_id):
+        product_id = int(product_id)
+        byte = product_id >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << (product_id & 7)))
+
+    def add(self, product_id):
+        product_id = check_product_id(product_id)
+        self._grow(product_id)
+        self.bits[product_id >> 3] |= 1 << (product_id & 7)
+
+
+class MappedArray:
+    """Fixed-width unsigned integers in a file, memory-mapped and grown on demand"""
+
+    def __init__(self, path, itemsize):
+        self.path = path
+        self.itemsize = itemsize
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.truncate(GROW_STEP * itemsize)
+        self.file = open(path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+    def _ensure(self, length):
+        if length <= len(self.map):
+            return
+        size = (length // (GROW_STEP * self.itemsize) + 1) * GROW_STEP * self.itemsize
+        self.map.close()
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+    def get(self, index):
+        offset = index * self.itemsize
+        if offset + self.itemsize > len(self.map):
+            return 0
+        if self.itemsize == 1:
+            return self.map[offset]
+        return int.from_bytes(self.map[offset:offset + self.itemsize], 'little')
+
+    def set(self, index, value):
+        offset = index * self.itemsize
+        self._ensure(offset + self.itemsize)
+        if self.itemsize == 1:
+            self.map[offset] = value
+        else:
+            self.map[offset:offset + self.itemsize] = value.to_bytes(self.itemsize, 'little')
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+
+class ProductIndex:
+    """Persistent product-ID index shared by every run.
+
+    seen.bitmap holds one bit per product ID ever crawled; fetched.days holds,
+    per product ID, the day (uint16, days since 2020-01-01) its page was last
+    downloaded. Both are memory-mapped, so lookups touch a few bytes and the
+    files stay in the low megabytes even with IDs in the tens of millions.
+    """
+
+    def __init__(self, index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.seen = MappedArray(os.path.join(index_dir, 'seen.bitmap'), 1)
+        self.fetched = MappedArray(os.path.join(index_dir, 'fetched.days'), 2)
+
+    @staticmethod
+    def today():
+        return (date.today() - EPOCH).days
+
+    def mark_seen(self, product_id):
+        """Record a crawled product; True if it had never been seen in any run"""
+        product_id = check_product_id(product_id)
+        byte, bit = product_id >> 3, 1 << (product_id & 7)
+        with self.lock:
+            current = self.seen.get(byte)
+            if current & bit:
+                return False
+            self.seen.set(byte, current | bit)
+            return True
+
+    def is_due(self, product_id, refresh_days):
+        """True if the page was never downloaded or its last download is refresh_days old"""
+        with self.lock:
+            last = self.fetched.get(int(product_id))
+        return last == 0 or self.today() - last >= refresh_days
+
+    def mark_fetched(self, product_id):
+        product_id = check_product_id(product_id)
+        with self.lock:
+            self.fetched.set(product_id, self.today())
+
+    def close(self):
+        with self.lock:
+            self.seen.close()
+            self.fetched.close()
+
+
+class StorefrontIndexes:
+    """One ProductIndex per storefront, opened on first use.
+
+    The primary storefront's index is root_dir itself, where single-storefront
+    runs always kept it; the others live in root_dir/<name>, since regional
+    storefronts reuse the same product IDs.
+    """
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def get(self, storefront):
+        with self.lock:
+            index = self.indexes.get(storefront.name)
+            if index is None:
+                index = self.indexes[storefront.name] = ProductIndex(storefront.index_dir(self.root_dir))
+            return index
+
+    def close(self):
+        with self.lock:
+            for index in self.indexes.values():
+                index.close()
+            self.indexes.clear()
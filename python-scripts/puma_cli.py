@@ -0,0 +1,48 @@
+import argparse
+import importlib
+import sys
+import metrics
+
+# Command -> (stage module, description). A stage module is only imported once
+# its command was picked, and the stages load requests, bs4, asyncio, pandas
+# and pyarrow inside the functions that need them, so --help and short runs
+# do not pay for dependencies they never use.
+COMMANDS = {
+    'crawl': ('1_obtain_urls_puma', "Crawl category pages (or the sitemap) and collect product URLs."),
+    'download': ('2_download_html_puma', "Download the product pages listed by a session's crawl."),
+    'scrape': ('3_scrapper_puma', "Extract color/size/price rows from a session's product pages."),
+    'history': ('4_price_history_puma', "Add a session's rows to the price history and report what changed."),
+    'run': ('run_pipeline', "Crawl, download and scrape as one streaming pipeline."),
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Run the Puma scraper stages. Pass --session-dir to every command to chain them explicitly; "
+                    "without it each command falls back to the session recorded in temp.txt.",
+        epilog="Use '<command> --help' for the options of a command.")
+    subparsers = parser.add_subparsers(dest='command', metavar='command', required=True)
+    for name, (_, description) in COMMANDS.items():
+        # The command's own options are added once its module is loaded, see main()
+        subparsers.add_parser(name, help=description, add_help=False)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, rest = parser.parse_known_args(argv)
+    module_name, description = COMMANDS[args.command]
+    stage = importlib.import_module(module_name)
+    command_parser = argparse.ArgumentParser(prog=f'{parser.prog} {args.command}', description=description)
+    stage.add_arguments(command_parser)
+    metrics.add_arguments(command_parser)
+    command_args = command_parser.parse_args(rest)
+    finish_metrics = metrics.setup(command_args)
+    result = stage.run(command_args)
+    finish_metrics()
+    # run_pipeline.run returns False when a stage failed
+    return 1 if result is False else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
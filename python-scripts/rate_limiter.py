@@ -0,0 +1,137 @@
+import threading
+import time
+from urllib.parse import urlparse
+from metrics import METRICS
+
+# Status codes that mean the site wants us to slow down
+THROTTLE_STATUSES = {429, 503}
+
+
+class TokenBucket:
+    """Token bucket for a single host. Not thread-safe on its own, HostRateLimiter holds the lock"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.latency_fast = None
+        self.latency_slow = None
+        self.last_decrease = 0.0
+
+    def refill(self, now):
+        elapsed = now - self.updated
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def reserve(self, now):
+        """Take one token and return how long the caller has to wait for it"""
+        self.refill(now)
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        # Negative tokens are reservations queued behind earlier callers
+        return -self.tokens / self.rate
+
+
+class HostRateLimiter:
+    """Per-host token buckets with additive-increase / multiplicative-decrease rate control.
+
+    Every request calls acquire() (or acquire_async()) before going out and
+    record() once the response or error is known. 429/503 responses, errors
+    and latency climbing well above its running baseline cut the host rate;
+    healthy responses raise it again step by step up to max_rate. Hosts
+    listed in host_rates start at their own rate instead of rate.
+    """
+
+    def __init__(self, rate=1.0, burst=2, min_rate=0.2, max_rate=8.0,
+                 increase_step=0.05, decrease_factor=0.5, latency_factor=2.0, cooldown=2.0):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+        self.host_rates = {}
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def set_host_rate(self, host, rate):
+        """Starting rate of one host, e.g. a storefront's requests_per_second"""
+        with self.lock:
+            self.host_rates[host] = rate
+            self.buckets.pop(host, None)
+
+    def _bucket(self, host):
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            bucket = TokenBucket(self.host_rates.get(host, self.rate), self.burst)
+            self.buckets[host] = bucket
+        return bucket
+
+    def reserve(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            return self._bucket(host).reserve(time.monotonic())
+
+    def acquire(self, url):
+        wait = self.reserve(url)
+        if wait > 0:
+            METRICS.inc('rate_limit_wait_seconds_total', wait, host=urlparse(url).netloc)
+            time.sleep(wait)
+
+    async def acquire_async(self, url):
+        import asyncio
+
+        wait = self.reserve(url)
+        if wait > 0:
+            METRICS.inc('rate_limit_wait_seconds_total', wait, host=urlparse(url).netloc)
+            await asyncio.sleep(wait)
+
+    def record(self, url, status=None, latency=None, retry_after=None):
+        """Feed back the outcome of a request. status=None means the request raised"""
+        host = urlparse(url).netloc
+        now = time.monotonic()
+        with self.lock:
+            bucket = self._bucket(host)
+            if status is None or status in THROTTLE_STATUSES:
+                self._decrease(bucket, now)
+                METRICS.inc('rate_limit_backoffs_total', host=host)
+                METRICS.set_gauge('rate_limit_rate', bucket.rate, host=host)
+                if retry_after:
+                    # Hold the whole host until the server says we may come back
+                    bucket.refill(now)
+                    bucket.tokens = min(bucket.tokens, -retry_after * bucket.rate)
+                return
+            if latency is not None:
+                if bucket.latency_slow is None:
+                    bucket.latency_fast = bucket.latency_slow = latency
+                else:
+                    bucket.latency_fast = 0.5 * bucket.latency_fast + 0.5 * latency
+                    bucket.latency_slow = 0.95 * bucket.latency_slow + 0.05 * latency
+                if bucket.latency_fast > bucket.latency_slow * self.latency_factor:
+                    self._decrease(bucket, now)
+                    return
+            bucket.refill(now)
+            # A starting rate configured above max_rate raises the ceiling with it
+            ceiling = max(self.max_rate, self.host_rates.get(host, self.rate))
+            bucket.rate = min(ceiling, bucket.rate + self.increase_step)
+
+    def _decrease(self, bucket, now):
+        # One cut per cooldown window, a burst of errors from requests that were
+        # already in flight should not collapse the rate to the floor
+        if now - bucket.last_decrease < self.cooldown:
+            return
+        bucket.refill(now)
+        bucket.rate = max(self.min_rate, bucket.rate * self.decrease_factor)
+        bucket.last_decrease = now
+
+
+def parse_retry_after(value):
+    """Retry-After header in seconds, HTTP-date values are ignored"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,206 @@
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from metrics import METRICS
+
+log = logging.getLogger(__name__)
+
+# Statuses worth another try: timeouts, throttling and server-side failures
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+MAX_ATTEMPTS = 4
+# Backoff before retry n is drawn from [0, min(MAX_DELAY, BASE_DELAY * 2 ** n)]
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+DEAD_LETTER_FILENAME = "dead_letter.jsonl"
+
+RETRYABLE_EXCEPTIONS = (TimeoutError, ConnectionError)
+# Transient errors of requests (Timeout covers connect and read timeouts) and
+# aiohttp, matched by name so neither has to be imported here
+RETRYABLE_EXCEPTION_NAMES = {'Timeout', 'ConnectionError', 'ChunkedEncodingError',
+                             'ClientConnectionError', 'ClientPayloadError', 'ServerTimeoutError'}
+
+
+class RetryableError(Exception):
+    """A failure worth retrying, e.g. a 503; retry_after is the server's hint in seconds"""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class PermanentError(Exception):
+    """A failure that will not go away by retrying, e.g. a 404"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def error_for_status(url, status, retry_after=None):
+    if status in RETRYABLE_STATUSES:
+        return RetryableError(f"{url} returned status {status}", status, retry_after)
+    return PermanentError(f"{url} returned status {status}", status)
+
+
+def is_retryable(error):
+    if isinstance(error, RetryableError):
+        return True
+    if isinstance(error, PermanentError):
+        return False
+    if isinstance(error, RETRYABLE_EXCEPTIONS):
+        return True
+    return any(cls.__name__ in RETRYABLE_EXCEPTION_NAMES for cls in type(error).__mro__)
+
+
+def error_reason(error):
+    status = getattr(error, 'status', None)
+    return str(status) if status else type(error).__name__
+
+
+def backoff_delay(attempt, retry_after=None, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    """Full-jitter exponential backoff after the given failed attempt (1-based), never below retry_after"""
+    delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+    return max(delay, retry_after or 0)
+
+
+def call_with_retries(func, *args, max_attempts=MAX_ATTEMPTS, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    """Call func inline, sleeping between retryable failures; for callers that do one request at a time"""
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return func(*args)
+        except Exception as e:
+            if attempt == max_attempts or not is_retryable(e):
+                raise
+            METRICS.inc('retries_total', reason=error_reason(e))
+            delay = backoff_delay(attempt, getattr(e, 'retry_after', None), base_delay, max_delay)
+            log.debug("Retrying in %.1fs after attempt %d: %s", delay, attempt, e)
+            time.sleep(delay)
+
+
+class DeadLetterFile:
+    """JSON lines of work that kept failing, with the last error, for a later replay"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def add(self, record, error, attempts):
+        line = dict(record, error=str(error), error_type=type(error).__name__,
+                    status=getattr(error, 'status', None), attempts=attempts,
+                    failed_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(line, ensure_ascii=False) + '\n')
+            self.count += 1
+        METRICS.inc('dead_letters_total', reason=error_reason(error))
+
+
+def read_dead_letters(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class _Job:
+    __slots__ = ('func', 'args', 'kwargs', 'outer', 'fallback', 'record', 'attempt')
+
+    def __init__(self, func, args, kwargs, fallback, record):
+        from concurrent.futures import Future
+
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.outer = Future()
+        self.fallback = fallback
+        self.record = record
+        self.attempt = 0
+
+
+class RetryScheduler:
+    """Run tasks on an executor and resubmit retryable failures after a jittered backoff.
+
+    Waiting retries sit in a heap ordered by due time and a single timer
+    thread hands them back to the executor when they are due, so no worker
+    ever sleeps on a backoff. submit() returns a Future for the final
+    outcome: the task's result, or once attempts run out (or on a permanent
+    error) fallback(error) with the task also written to the dead-letter
+    file.
+    """
+
+    def __init__(self, executor, max_attempts=MAX_ATTEMPTS, base_delay=BASE_DELAY, max_delay=MAX_DELAY,
+                 dead_letter=None):
+        self.executor = executor
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.dead_letter = dead_letter
+        self.delayed = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.closed = False
+        METRICS.gauge_callback('queue_depth', lambda: len(self.delayed), queue='retry')
+        self.thread = threading.Thread(target=self._run, name='retry-timer', daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args, fallback=None, record=None, **kwargs):
+        job = _Job(func, args, kwargs, fallback, record)
+        self._launch(job)
+        return job.outer
+
+    def _launch(self, job):
+        job.attempt += 1
+        future = self.executor.submit(job.func, *job.args, **job.kwargs)
+        future.add_done_callback(lambda future, job=job: self._finished(job, future))
+
+    def _finished(self, job, future):
+        error = future.exception()
+        if error is None:
+            job.outer.set_result(future.result())
+            return
+        if is_retryable(error) and job.attempt < self.max_attempts:
+            METRICS.inc('retries_total', reason=error_reason(error))
+            delay = backoff_delay(job.attempt, getattr(error, 'retry_after', None), self.base_delay, self.max_delay)
+            log.debug("Retrying in %.1fs after attempt %d: %s", delay, job.attempt, error)
+            with self.condition:
+                heapq.heappush(self.delayed, (time.monotonic() + delay, next(self.sequence), job))
+                self.condition.notify()
+            return
+        log.warning("Giving up after %d attempts: %s", job.attempt, error)
+        if self.dead_letter is not None and job.record is not None:
+            self.dead_letter.add(job.record, error, job.attempt)
+        if job.fallback is not None:
+            job.outer.set_result(job.fallback(error))
+        else:
+            job.outer.set_exception(error)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.delayed:
+                        wait = self.delayed[0][0] - time.monotonic()
+                        if wait <= 0:
+                            job = heapq.heappop(self.delayed)[2]
+                            break
+                        self.condition.wait(wait)
+                    elif self.closed:
+                        return
+                    else:
+                        self.condition.wait()
+            self._launch(job)
+
+    def close(self):
+        """Stop the timer thread once every delayed retry has been handed to the executor"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
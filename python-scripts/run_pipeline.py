@@ -0,0 +1,208 @@
+import argparse
+import csv
+import importlib
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+import metrics
+from metrics import METRICS
+import storefronts
+from retry_queue import DeadLetterFile, DEAD_LETTER_FILENAME
+
+# The stage scripts start with a digit, so they can only be loaded by name
+crawl_stage = importlib.import_module('1_obtain_urls_puma')
+download_stage = importlib.import_module('2_download_html_puma')
+scrape_stage = importlib.import_module('3_scrapper_puma')
+
+# Rows waiting between two stages; a full queue makes the stage before it wait
+QUEUE_SIZE = 256
+DOWNLOAD_WORKERS = download_stage.MAX_WORKERS
+SCRAPE_WORKERS = scrape_stage.MAX_WORKERS
+# End-of-stream marker put on a queue once per consumer
+DONE = None
+
+log = logging.getLogger('puma.pipeline')
+
+
+class LockedDictWriter:
+    """csv.DictWriter shared by the download threads; the header comes from the first row"""
+
+    def __init__(self, f, extra_fields):
+        self.f = f
+        self.extra_fields = extra_fields
+        self.writer = None
+        self.rows = 0
+        self.lock = threading.Lock()
+
+    def writerow(self, row):
+        with self.lock:
+            if self.writer is None:
+                fieldnames = list(row.keys())
+                fieldnames += [name for name in self.extra_fields if name not in fieldnames]
+                self.writer = csv.DictWriter(self.f, fieldnames=fieldnames, delimiter=';')
+                self.writer.writeheader()
+            self.writer.writerow(row)
+            self.rows += 1
+
+
+def run_crawl(input_file, crawl_csv, download_queue, consumers, errors):
+    def enqueue(row):
+        first_encounter_value = str(row.get('first_encounter', '')).strip().lower()
+        if first_encounter_value == 'first encounter':
+            download_queue.put(row)
+
+    try:
+        crawl_stage.process_urls(input_file, crawl_csv, on_row=enqueue)
+    except Exception as e:
+        errors.append(('crawl', e))
+    finally:
+        for _ in range(consumers):
+            download_queue.put(DONE)
+
+
+def run_downloads(download_queue, scrape_queue, output_folder, writer, dead_letter):
+    while True:
+        row = download_queue.get()
+        if row is DONE:
+            return
+        # Retries wait inline in this thread; pages that still fail go to the dead-letter file
+        filename, filepath, _, _ = download_stage.download_html_task(
+            (row['crawled_url'], row['url'], output_folder), dead_letter=dead_letter, row=row)
+        row = dict(row, html_filename=filename or '', html_filepath=filepath or '')
+        writer.writerow(row)
+        METRICS.inc('rows_total', stage='download')
+        if filepath:
+            scrape_queue.put(filepath)
+
+
+def run_pipeline(input_file="input_urls_puma.csv", download_workers=DOWNLOAD_WORKERS,
+                 scrape_workers=SCRAPE_WORKERS, queue_size=QUEUE_SIZE, session_dir=None):
+    """Crawl, download and scrape in one process, each page moving on as soon as its stage is done.
+
+    The crawler hands first-encounter product rows to a pool of download
+    threads through a bounded queue; downloaded pages go through a second
+    bounded queue to a process pool that scrapes them. Output files are the
+    same ones the three scripts write when run one after the other, in
+    session_dir when given, else in a new session recorded in temp.txt.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    started = time.monotonic()
+    session_html_dir, crawl_csv = crawl_stage.create_session(session_dir)
+    output_folder = os.path.join(session_html_dir, "htmls")
+    os.makedirs(output_folder, exist_ok=True)
+    complete_csv = os.path.join(output_folder, "complete_data.csv")
+    scrape_csv = os.path.join(session_html_dir, scrape_stage.OUTPUT_FILENAME)
+    # Same dead-letter file stage 2 keeps, so --replay-dead-letter works on pipeline sessions too
+    dead_letter_path = os.path.join(session_html_dir, DEAD_LETTER_FILENAME)
+    dead_letter = DeadLetterFile(dead_letter_path + '.new')
+
+    download_queue = queue.Queue(maxsize=queue_size)
+    scrape_queue = queue.Queue(maxsize=queue_size)
+    errors = []
+    counters = {'scraped': 0, 'rows': 0}
+    stage_finished = {}
+    METRICS.gauge_callback('queue_depth', download_queue.qsize, queue='download')
+    METRICS.gauge_callback('queue_depth', scrape_queue.qsize, queue='scrape')
+
+    with open(complete_csv, 'w', newline='', encoding='utf-8') as f_complete, \
+            open(scrape_csv, 'w', newline='', encoding='utf-8') as f_scrape:
+        complete_writer = LockedDictWriter(f_complete, ['html_filename', 'html_filepath'])
+        crawler = threading.Thread(
+            target=run_crawl, args=(input_file, crawl_csv, download_queue, download_workers, errors),
+            name='crawl', daemon=True)
+        downloaders = [
+            threading.Thread(
+                target=run_downloads,
+                args=(download_queue, scrape_queue, output_folder, complete_writer, dead_letter),
+                name=f'download-{i}', daemon=True)
+            for i in range(download_workers)
+        ]
+
+        def close_downloads():
+            crawler.join()
+            stage_finished['crawl'] = time.monotonic()
+            for thread in downloaders:
+                thread.join()
+            stage_finished['download'] = time.monotonic()
+            scrape_queue.put(DONE)
+
+        crawler.start()
+        for thread in downloaders:
+            thread.start()
+        threading.Thread(target=close_downloads, name='download-closer', daemon=True).start()
+
+        scrape_writer = csv.writer(f_scrape, delimiter=';')
+        scrape_writer.writerow(scrape_stage.header)
+        in_flight = deque()
+        with ProcessPoolExecutor(max_workers=scrape_workers, initializer=scrape_stage.init_worker,
+                                 initargs=(storefronts.config_path(),)) as executor:
+            def write_next():
+                rows, seconds = in_flight.popleft().result()
+                METRICS.observe('parse_seconds', seconds, stage='scrape')
+                METRICS.inc('pages_total', stage='scrape')
+                METRICS.inc('rows_total', len(rows), stage='scrape')
+                scrape_writer.writerows(rows)
+                counters['scraped'] += 1
+                counters['rows'] += len(rows)
+
+            while True:
+                filepath = scrape_queue.get()
+                if filepath is DONE:
+                    break
+                in_flight.append(executor.submit(
+                    scrape_stage.run_timed, scrape_stage.extract_data_from_html, filepath))
+                while in_flight and (len(in_flight) >= scrape_workers * 4 or in_flight[0].done()):
+                    write_next()
+            while in_flight:
+                write_next()
+        stage_finished['scrape'] = time.monotonic()
+
+    if session_dir is None:
+        # Same hand-off file the separate scripts leave behind
+        relative_output_folder = os.path.relpath(output_folder, crawl_stage.SCRIPT_DIR)
+        with open(crawl_stage.temp_file_path, "a") as f:
+            f.write(f"\noutput_dir_htmls={relative_output_folder}")
+
+    download_stage.finish_dead_letter(dead_letter, dead_letter_path)
+    for stage, error in errors:
+        log.error("🚨 %s stage failed: %s", stage, error)
+    for stage in ('crawl', 'download', 'scrape'):
+        log.info("⏱️ %s finished after %.1fs", stage, stage_finished[stage] - started)
+    log.info("✅ Pipeline complete: %d product pages fetched, %d scraped into %d rows",
+             complete_writer.rows, counters['scraped'], counters['rows'])
+    log.info("📄 %s, %s, %s", crawl_csv, complete_csv, scrape_csv)
+    return not errors
+
+
+def add_arguments(parser):
+    """Options of the streaming pipeline, shared by this script and puma_cli.py"""
+    parser.add_argument('--input', default="input_urls_puma.csv",
+                        help="category URL CSV, relative to this script unless absolute")
+    parser.add_argument('--session-dir', default=None,
+                        help="session directory to write to (default: a new downloaded_htmls/<timestamp>, "
+                             "recorded in temp.txt)")
+    parser.add_argument('--download-workers', type=int, default=DOWNLOAD_WORKERS, help="download threads")
+    parser.add_argument('--scrape-workers', type=int, default=SCRAPE_WORKERS, help="scraper processes")
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE, help="rows buffered between two stages")
+    storefronts.add_arguments(parser)
+
+
+def run(args):
+    stores = storefronts.configure(args.storefronts)
+    stores.apply_rates(crawl_stage.RATE_LIMITER)
+    stores.apply_rates(download_stage.RATE_LIMITER)
+    return run_pipeline(args.input, args.download_workers, args.scrape_workers, args.queue_size, args.session_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run crawl, download and scrape as one streaming pipeline.")
+    add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    finish_metrics = metrics.setup(args)
+    run(args)
+    finish_metrics()
@@ -0,0 +1,56 @@
+import json
+import sqlite3
+from datetime import datetime
+
+
+class ScrapeManifest:
+    """SQLite record of which pages were scraped, in what state, and the rows they gave.
+
+    A source is a .html path or a pack store key. Its signature is whatever
+    changes when the page does: "size:mtime_ns" for files, the content hash
+    for pack entries. Sources whose signature still matches keep their stored
+    rows and are not parsed again.
+    """
+
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(str(db_path))
+        self.db.execute('''CREATE TABLE IF NOT EXISTS sources (
+            source TEXT PRIMARY KEY, signature TEXT, rows TEXT, extracted_at TEXT)''')
+        self.db.commit()
+        self.known = {source: signature for source, signature
+                      in self.db.execute('SELECT source, signature FROM sources')}
+        self.pending = 0
+
+    def is_current(self, source, signature):
+        return self.known.get(source) == signature
+
+    def stored_rows(self, source):
+        row = self.db.execute('SELECT rows FROM sources WHERE source = ?', (source,)).fetchone()
+        return [tuple(r) for r in json.loads(row[0])] if row else []
+
+    def record(self, source, signature, rows, commit_every=500):
+        self.db.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)',
+                        (source, signature, json.dumps(rows, ensure_ascii=False),
+                         datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        self.known[source] = signature
+        self.pending += 1
+        if self.pending >= commit_every:
+            self.db.commit()
+            self.pending = 0
+
+    def forget_missing(self, present_sources):
+        """Drop sources that are gone from the directory or pack; returns how many"""
+        missing = [source for source in self.known if source not in present_sources]
+        self.db.executemany('DELETE FROM sources WHERE source = ?', ((source,) for source in missing))
+        for source in missing:
+            del self.known[source]
+        self.db.commit()
+        return len(missing)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+def file_signature(stat_result):
+    return f"{stat_result.st_size}:{stat_result.st_mtime_ns}"
@@ -0,0 +1,119 @@
+import gzip
+import json
+import logging
+import os
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from retry_queue import RetryableError, PermanentError
+
+log = logging.getLogger(__name__)
+
+SITEMAP_NS = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+# Nested sitemap indexes deeper than this are ignored
+MAX_DEPTH = 3
+# Failures that make one sitemap unreadable without stopping the others
+READ_ERRORS = (IOError, ET.ParseError, RetryableError, PermanentError)
+
+
+def parse_lastmod(value):
+    """W3C datetime from <lastmod> as an aware UTC datetime, None if missing or malformed"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def iter_sitemap_entries(source):
+    """Stream ('sitemap' | 'url', loc, lastmod) tuples out of a sitemap or sitemap index.
+
+    Elements are cleared as soon as they are read, so memory stays flat no
+    matter how many <url> entries the file holds.
+    """
+    loc = lastmod = None
+    context = ET.iterparse(source, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event != 'end':
+            continue
+        tag = elem.tag.replace(SITEMAP_NS, '')
+        if tag == 'loc':
+            loc = (elem.text or '').strip()
+        elif tag == 'lastmod':
+            lastmod = parse_lastmod(elem.text)
+        elif tag in ('url', 'sitemap'):
+            if loc:
+                yield tag, loc, lastmod
+            loc = lastmod = None
+            root.clear()
+
+
+def open_sitemap(url, fetch_stream):
+    """File-like body of a sitemap, gunzipped when it is a .xml.gz"""
+    response = fetch_stream(url)
+    if response.status_code != 200:
+        response.close()
+        raise IOError(f"sitemap {url} returned status {response.status_code}")
+    response.raw.decode_content = True
+    if url.endswith('.gz'):
+        return response, gzip.GzipFile(fileobj=response.raw)
+    return response, response.raw
+
+
+def discover_urls(sitemap_url, fetch_stream, since=None, depth=0, stats=None):
+    """Yield (loc, lastmod) for every page URL reachable from sitemap_url.
+
+    Child sitemaps and URLs whose <lastmod> is not newer than since are
+    skipped; entries without <lastmod> are always kept. fetch_stream(url)
+    must return a streamed requests.Response. Child sitemaps that cannot be
+    read are logged and counted in stats['failed'], so the caller knows the
+    listing is incomplete.
+    """
+    if stats is None:
+        stats = {'sitemaps': 0, 'urls': 0, 'unchanged': 0, 'failed': 0}
+    response, body = open_sitemap(sitemap_url, fetch_stream)
+    stats['sitemaps'] += 1
+    children = []
+    with response:
+        for kind, loc, lastmod in iter_sitemap_entries(body):
+            if since is not None and lastmod is not None and lastmod <= since:
+                stats['unchanged'] += 1
+                continue
+            if kind == 'sitemap':
+                # Finish streaming this file before opening the next connection
+                children.append(loc)
+            else:
+                stats['urls'] += 1
+                yield loc, lastmod
+    if depth < MAX_DEPTH:
+        for child in children:
+            try:
+                yield from discover_urls(child, fetch_stream, since, depth + 1, stats)
+            except READ_ERRORS as e:
+                log.error("Skipping sitemap %s: %s", child, e)
+                stats['failed'] += 1
+
+
+def load_last_run(state_path, sitemap_url):
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            value = json.load(f).get(sitemap_url)
+    except (FileNotFoundError, ValueError):
+        return None
+    return parse_lastmod(value)
+
+
+def save_last_run(state_path, sitemap_url, started_at):
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        state = {}
+    state[sitemap_url] = started_at.isoformat()
+    os.makedirs(os.path.dirname(os.path.abspath(state_path)), exist_ok=True)
+    with open(state_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
@@ -0,0 +1,148 @@
+import json
+import os
+import re
+from urllib.parse import urlparse
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+STOREFRONTS_FILE = os.path.join(SCRIPT_DIR, 'storefronts.json')
+# Storefront names end up in file names and index directories
+NAME_RE = re.compile(r'^[a-z0-9_]+$')
+# Per-product file stem: the primary storefront's pages keep the bare product ID
+PRODUCT_KEY_RE = re.compile(r'^(?:([a-z0-9_]+)-)?(\d+)$')
+
+
+class Storefront:
+    """One Magento storefront: its host, the spConfig attribute codes it uses and its politeness settings.
+
+    currency is the ISO 4217 code stage 3 writes next to every price, since
+    currency_symbol ('$') is shared by several regional storefronts.
+    requests_per_second and concurrency are optional; a stage falls back to
+    its own --rate and worker settings for storefronts that leave them out.
+    """
+
+    def __init__(self, name, host, sitemap_url=None, color_attributes=('color', 'colour', 'tinte'),
+                 size_attributes=('size', 'talla'), currency=None, currency_symbol='$',
+                 requests_per_second=None, concurrency=None, primary=False):
+        if not NAME_RE.match(name):
+            raise ValueError(f"Storefront name must match {NAME_RE.pattern}: {name!r}")
+        self.name = name
+        self.host = host
+        self.sitemap_url = sitemap_url or f'https://{host}/sitemap.xml'
+        self.color_attributes = tuple(color_attributes)
+        self.size_attributes = tuple(size_attributes)
+        self.currency = currency
+        self.currency_symbol = currency_symbol
+        self.requests_per_second = requests_per_second
+        self.concurrency = concurrency
+        self.primary = primary
+
+    def product_key(self, product_id):
+        """Run-wide identity of a product: its file stem, checkpoint key and dedup key.
+
+        The primary storefront keeps the bare product ID, so single-storefront
+        sessions, files and indexes look exactly as they always did; the others
+        are prefixed with their name, since regional sites share product IDs.
+        """
+        return str(product_id) if self.primary else f'{self.name}-{product_id}'
+
+    def index_dir(self, root_dir):
+        """This storefront's product_index.ProductIndex directory under root_dir"""
+        return str(root_dir) if self.primary else os.path.join(str(root_dir), self.name)
+
+    def __repr__(self):
+        return f'Storefront({self.name!r}, {self.host!r})'
+
+
+class Storefronts:
+    """The configured storefronts, looked up by host, name or product key. The first one is the primary."""
+
+    def __init__(self, storefronts=()):
+        self.by_host = {}
+        self.by_name = {}
+        for storefront in storefronts:
+            self.add(storefront)
+
+    @classmethod
+    def load(cls, path=STOREFRONTS_FILE):
+        """Storefronts from a JSON list of objects with Storefront's argument names"""
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        return cls(Storefront(**dict(entry, primary=i == 0)) for i, entry in enumerate(entries))
+
+    def add(self, storefront):
+        if storefront.name in self.by_name or storefront.host in self.by_host:
+            raise ValueError(f"Duplicate storefront name or host: {storefront!r}")
+        if not self.by_name:
+            storefront.primary = True
+        self.by_host[storefront.host] = storefront
+        self.by_name[storefront.name] = storefront
+
+    def __iter__(self):
+        return iter(self.by_name.values())
+
+    def __len__(self):
+        return len(self.by_name)
+
+    @property
+    def primary(self):
+        return next(iter(self.by_name.values()), None)
+
+    def for_url(self, url):
+        """Storefront serving url, None for any other host"""
+        return self.by_host.get(urlparse(url).netloc)
+
+    def concurrency(self, host, default):
+        """Requests the host may have in flight: its storefront's concurrency, else default"""
+        storefront = self.by_host.get(host)
+        return storefront.concurrency if storefront is not None and storefront.concurrency else default
+
+    def apply_rates(self, limiter):
+        """Start every storefront that sets requests_per_second at that rate in a HostRateLimiter"""
+        for storefront in self:
+            if storefront.requests_per_second:
+                limiter.set_host_rate(storefront.host, storefront.requests_per_second)
+
+    def split_product_key(self, key):
+        """(storefront, product ID) of a key made by Storefront.product_key, (None, None) if it is not one"""
+        match = PRODUCT_KEY_RE.match(key)
+        if not match:
+            return None, None
+        storefront = self.by_name.get(match.group(1)) if match.group(1) else self.primary
+        return storefront, match.group(2) if storefront is not None else None
+
+    def color_attributes(self):
+        """Every configured color attribute code, for pages whose storefront is not known"""
+        return {code for storefront in self for code in storefront.color_attributes}
+
+    def size_attributes(self):
+        return {code for storefront in self for code in storefront.size_attributes}
+
+
+_storefronts = None
+_storefronts_path = STOREFRONTS_FILE
+
+
+def configure(path=STOREFRONTS_FILE):
+    """Load the storefronts from path for the rest of the process"""
+    global _storefronts, _storefronts_path
+    _storefronts = Storefronts.load(path)
+    _storefronts_path = path
+    return _storefronts
+
+
+def get_storefronts():
+    """The configured storefronts, read from storefronts.json on first use"""
+    if _storefronts is None:
+        return configure(_storefronts_path)
+    return _storefronts
+
+
+def config_path():
+    """File the storefronts were (or will be) loaded from, to hand to worker processes"""
+    return _storefronts_path
+
+
+def add_arguments(parser):
+    """--storefronts for a stage's CLI"""
+    parser.add_argument('--storefronts', default=STOREFRONTS_FILE, metavar='PATH',
+                        help="JSON list of storefronts: host, attribute codes, currency and politeness settings")